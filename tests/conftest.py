@@ -0,0 +1,62 @@
+"""Shared fixtures for the wasm-safe-eval test suite."""
+
+import os
+
+import pytest
+
+from wasm_safe_eval import _embedded
+from wasm_safe_eval._paths import (
+    _try_find_wasmtime,
+    get_rustpython_cwasm_path,
+    get_rustpython_wasm_path,
+)
+from wasm_safe_eval.safe_eval import _POOLS, POOL_SIZE_ENV, _get_pool, safe_eval_batch
+
+
+def pytest_sessionstart(session):
+    """Precompile the modules once, before xdist workers race to do it."""
+    if hasattr(session.config, "workerinput"):
+        return
+    wasmtime_exec = _try_find_wasmtime()
+    if wasmtime_exec is not None:
+        get_rustpython_cwasm_path(wasmtime_exec)
+        get_rustpython_cwasm_path(wasmtime_exec, epoch_interruption=True)
+    if _embedded.wasmtime is not None:
+        _embedded._module(get_rustpython_wasm_path())
+
+
+@pytest.fixture(scope="session", autouse=True)
+def worker_pool():
+    """Boot the reused-process pool once per session and stop it at the end.
+
+    Under xdist, the CPU budget is split between the xdist workers so the
+    pools together start at most one wasmtime worker per core.
+    """
+    wasmtime_exec = _try_find_wasmtime()
+    if wasmtime_exec is None:
+        yield None
+        return
+
+    n_xdist_workers = int(os.environ.get("PYTEST_XDIST_WORKER_COUNT", "1"))
+    with pytest.MonkeyPatch.context() as mp:
+        # undone on teardown, so the pool size doesn't outlive the session
+        if POOL_SIZE_ENV not in os.environ:
+            mp.setenv(POOL_SIZE_ENV, str(max(1, (os.cpu_count() or 1) // n_xdist_workers)))
+        pool = _get_pool(wasmtime_exec, get_rustpython_cwasm_path(wasmtime_exec))
+        pool.release(pool.acquire())
+
+        yield pool
+
+        for pool in _POOLS.values():
+            pool.close()
+
+
+@pytest.fixture(scope="class")
+def batch_results(request):
+    """Run all of the test module's `BATCH_SNIPPETS` in a single wasmtime process.
+
+    `BATCH_SNIPPETS` is a list of `pytest.param`s whose first value is the code;
+    the results are keyed by that code.
+    """
+    codes = [param.values[0] for param in request.module.BATCH_SNIPPETS]
+    return dict(zip(codes, safe_eval_batch(codes)))
@@ -1,84 +1,79 @@
 """Basic functionality tests for wasm-safe-eval."""
 
-import pytest
-from wasm_safe_eval.safe_eval import safe_eval, safe_func_call
-
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
 
-class TestBasicFunctionality:
-    """Test basic functionality of safe_eval and safe_func_call."""
+import pytest
 
-    def test_simple_arithmetic(self):
-        """Test that simple arithmetic works."""
-        code = "print(2 + 2)"
-        stdout, stderr, returncode = safe_eval(code)
-        
-        assert returncode == 0
-        assert "4" in stdout
-        assert stderr == ""
+from wasm_safe_eval import _embedded
+from wasm_safe_eval._embedded import get_embedded_cwasm_path
+from wasm_safe_eval._paths import (
+    _try_find_wasmtime,
+    get_rustpython_cwasm_path,
+    get_rustpython_wasm_path,
+)
+from wasm_safe_eval.safe_eval import (
+    _BYTECODE_CACHE,
+    _BYTECODE_MIN_SIZE,
+    _POOLS,
+    FuncCallStatus,
+    _close_pools,
+    _WorkerPool,
+    safe_eval,
+    safe_eval_async,
+    safe_eval_batch,
+    safe_eval_parallel,
+    safe_func_call,
+    safe_func_call_batch,
+)
 
-    def test_string_operations(self):
-        """Test that string operations work."""
-        code = """
+BASIC_SNIPPETS = [
+    pytest.param("print(2 + 2)", ["4"], id="simple_arithmetic"),
+    pytest.param(
+        """
 text = "Hello, World!"
 print(text.upper())
 print(text.lower())
 print(len(text))
-"""
-        stdout, stderr, returncode = safe_eval(code)
-        
-        assert returncode == 0
-        assert "HELLO, WORLD!" in stdout
-        assert "hello, world!" in stdout
-        assert "13" in stdout
-
-    def test_list_operations(self):
-        """Test that list operations work."""
-        code = """
+""",
+        ["HELLO, WORLD!", "hello, world!", "13"],
+        id="string_operations",
+    ),
+    pytest.param(
+        """
 numbers = [1, 2, 3, 4, 5]
 print(f"Sum: {sum(numbers)}")
 print(f"Length: {len(numbers)}")
 print(f"Max: {max(numbers)}")
-"""
-        stdout, stderr, returncode = safe_eval(code)
-        
-        assert returncode == 0
-        assert "Sum: 15" in stdout
-        assert "Length: 5" in stdout
-        assert "Max: 5" in stdout
-
-    def test_dictionary_operations(self):
-        """Test that dictionary operations work."""
-        code = """
+""",
+        ["Sum: 15", "Length: 5", "Max: 5"],
+        id="list_operations",
+    ),
+    pytest.param(
+        """
 data = {"name": "Alice", "age": 30, "city": "New York"}
 print(f"Name: {data['name']}")
 print(f"Keys: {list(data.keys())}")
 print(f"Values: {list(data.values())}")
-"""
-        stdout, stderr, returncode = safe_eval(code)
-        
-        assert returncode == 0
-        assert "Name: Alice" in stdout
-        assert "Keys:" in stdout
-        assert "Values:" in stdout
-
-    def test_function_definition(self):
-        """Test that function definitions work."""
-        code = """
+""",
+        ["Name: Alice", "Keys:", "Values:"],
+        id="dictionary_operations",
+    ),
+    pytest.param(
+        """
 def fibonacci(n):
     if n <= 1:
         return n
     return fibonacci(n-1) + fibonacci(n-2)
 
 print(f"Fibonacci(10): {fibonacci(10)}")
-"""
-        stdout, stderr, returncode = safe_eval(code)
-        
-        assert returncode == 0
-        assert "Fibonacci(10): 55" in stdout
-
-    def test_class_definition(self):
-        """Test that class definitions work."""
-        code = """
+""",
+        ["Fibonacci(10): 55"],
+        id="function_definition",
+    ),
+    pytest.param(
+        """
 class Person:
     def __init__(self, name, age):
         self.name = name
@@ -89,15 +84,12 @@ class Person:
 
 person = Person("Bob", 25)
 print(person.greet())
-"""
-        stdout, stderr, returncode = safe_eval(code)
-        
-        assert returncode == 0
-        assert "Hello, I'm Bob and I'm 25 years old" in stdout
-
-    def test_loop_operations(self):
-        """Test that loops work."""
-        code = """
+""",
+        ["Hello, I'm Bob and I'm 25 years old"],
+        id="class_definition",
+    ),
+    pytest.param(
+        """
 # For loop
 total = 0
 for i in range(5):
@@ -109,16 +101,12 @@ count = 0
 while count < 3:
     count += 1
 print(f"While loop count: {count}")
-"""
-        stdout, stderr, returncode = safe_eval(code)
-        
-        assert returncode == 0
-        assert "For loop total: 10" in stdout
-        assert "While loop count: 3" in stdout
-
-    def test_exception_handling(self):
-        """Test that exception handling works."""
-        code = """
+""",
+        ["For loop total: 10", "While loop count: 3"],
+        id="loop_operations",
+    ),
+    pytest.param(
+        """
 try:
     result = 10 / 0
 except ZeroDivisionError as e:
@@ -126,28 +114,49 @@ except ZeroDivisionError as e:
     result = "undefined"
 
 print(f"Result: {result}")
-"""
-        stdout, stderr, returncode = safe_eval(code)
-        
-        assert returncode == 0
-        assert "Caught exception: ZeroDivisionError" in stdout
-        assert "Result: undefined" in stdout
-
-    def test_list_comprehension(self):
-        """Test that list comprehensions work."""
-        code = """
+""",
+        ["Caught exception: ZeroDivisionError", "Result: undefined"],
+        id="exception_handling",
+    ),
+    pytest.param(
+        """
 numbers = [1, 2, 3, 4, 5]
 squares = [x**2 for x in numbers]
 evens = [x for x in numbers if x % 2 == 0]
 
 print(f"Squares: {squares}")
 print(f"Evens: {evens}")
-"""
-        stdout, stderr, returncode = safe_eval(code)
-        
+""",
+        ["Squares: [1, 4, 9, 16, 25]", "Evens: [2, 4]"],
+        id="list_comprehension",
+    ),
+]
+
+
+# run together by the `batch_results` fixture in conftest.py
+BATCH_SNIPPETS = BASIC_SNIPPETS
+
+
+class TestBasicFunctionality:
+    """Test basic functionality of safe_eval and safe_func_call."""
+
+    @pytest.mark.parametrize("code, expected", BASIC_SNIPPETS)
+    def test_snippet(self, batch_results, code, expected):
+        """Test that basic language features work and print what they should."""
+        stdout, stderr, returncode = batch_results[code]
+
+        assert returncode == 0
+        assert stderr == ""
+        for substring in expected:
+            assert substring in stdout
+
+    def test_safe_eval_single_snippet(self):
+        """Test that a snippet also runs on its own wasmtime process."""
+        stdout, stderr, returncode = safe_eval("print(2 + 2)")
+
         assert returncode == 0
-        assert "Squares: [1, 4, 9, 16, 25]" in stdout
-        assert "Evens: [2, 4]" in stdout
+        assert "4" in stdout
+        assert stderr == ""
 
     def test_safe_func_call_basic(self):
         """Test basic safe_func_call functionality."""
@@ -167,11 +176,22 @@ def add(a, b):
 def greet(name, greeting="Hello"):
     return f"{greeting}, {name}!"
 """
-        result, stderr, returncode = safe_func_call(code, ["Alice"], {"greeting": "Hi"}, "greet")
+        result, _stderr, returncode = safe_func_call(code, ["Alice"], {"greeting": "Hi"}, "greet")
         
         assert returncode == 0
         assert result == "Hi, Alice!"
 
+    def test_safe_func_call_non_finite_args(self):
+        """Test that NaN and Infinity reach the function as floats, not None."""
+        code = """
+def check(x, y):
+    return [x != x, y == float("inf")]
+"""
+        result, _stderr, returncode = safe_func_call(code, [float("nan"), float("inf")], {}, "check")
+
+        assert returncode == 0
+        assert result == [True, True]
+
     def test_safe_func_call_complex_return(self):
         """Test safe_func_call with complex return values."""
         code = """
@@ -184,11 +204,373 @@ def analyze_list(data):
         "max": max(data) if data else None
     }
 """
-        result, stderr, returncode = safe_func_call(code, [[1, 2, 3, 4, 5]], {}, "analyze_list")
+        result, _stderr, returncode = safe_func_call(code, [[1, 2, 3, 4, 5]], {}, "analyze_list")
         
         assert returncode == 0
         assert result["length"] == 5
         assert result["sum"] == 15
         assert result["average"] == 3.0
         assert result["min"] == 1
-        assert result["max"] == 5
\ No newline at end of file
+        assert result["max"] == 5
+
+    def test_safe_func_call_future_import(self):
+        """Test that user code may start with a `from __future__` import."""
+        code = """from __future__ import annotations
+
+def double(x: int) -> int:
+    return x * 2
+"""
+        result, _stderr, returncode = safe_func_call(code, [21], {}, "double")
+
+        assert returncode == 0
+        assert result == 42
+
+class TestReuseProcess:
+    """Test running snippets on a long-lived wasmtime process."""
+
+    def test_reuse_process_runs_snippets(self):
+        """Test that several snippets can run on the same process."""
+        for i in range(3):
+            stdout, stderr, returncode = safe_eval(f"print({i} * 2)", reuse_process=True)
+
+            assert returncode == 0
+            assert stdout == f"{i * 2}\n"
+            assert stderr == ""
+
+    def test_reuse_process_fresh_globals(self):
+        """Test that globals do not leak between snippets on the same process."""
+        safe_eval("leaked = 1", reuse_process=True)
+        _stdout, stderr, returncode = safe_eval("print(leaked)", reuse_process=True)
+
+        assert returncode != 0
+        assert "NameError" in stderr
+
+    def test_reuse_process_safe_func_call(self):
+        """Test safe_func_call on a reused process."""
+        code = """
+def add(a, b):
+    return a + b
+"""
+        result, _stderr, returncode = safe_func_call(code, [3, 4], {}, "add", reuse_process=True)
+
+        assert returncode == 0
+        assert result == 7
+
+    @pytest.mark.parametrize(
+        "code",
+        [
+            pytest.param("import os; print(os.read(0, 10))", id="os_read_fd0"),
+            pytest.param("import posix; print(posix.read(0, 10))", id="posix_read_fd0"),
+            pytest.param("print(repr(open(0).read()))", id="open_fd0"),
+            pytest.param("import sys; print(repr(sys.stdin.read()))", id="sys_stdin"),
+            pytest.param("import sys; sys.exit(300)", id="exit_300"),
+            pytest.param("import sys; sys.exit(-1)", id="exit_negative"),
+            pytest.param("import sys; sys.exit(7)", id="exit_7"),
+            pytest.param("import sys; sys.exit('message')", id="exit_message"),
+        ],
+    )
+    def test_reuse_process_matches_one_shot(self, code):
+        """Test that stdin reads and exit codes on a worker match a fresh process."""
+        one_shot = safe_eval(code, timeout=30)
+        reused = safe_eval(code, timeout=30, reuse_process=True)
+
+        assert (reused.stdout, reused.returncode) == (one_shot.stdout, one_shot.returncode)
+
+    def test_reuse_process_recovers_from_raw_fd_writes(self):
+        """Test that a worker whose stream was corrupted is replaced."""
+        _stdout, stderr, returncode = safe_eval("import os; os.write(1, b'junk')", reuse_process=True)
+        assert returncode != 0
+        assert "malformed response" in stderr
+
+        assert safe_eval("print('fine')", reuse_process=True, timeout=30).stdout == "fine\n"
+
+    def test_reuse_process_concurrent_calls(self):
+        """Test that concurrent calls on reused processes get their own results."""
+        codes = [f"print({i} ** 2)" for i in range(8)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda c: safe_eval(c, reuse_process=True), codes))
+
+        for i, (stdout, stderr, returncode) in enumerate(results):
+            assert returncode == 0
+            assert stdout == f"{i ** 2}\n"
+
+
+    def test_close_while_busy_keeps_pool_size(self):
+        """Test that a worker released after close is stopped, not added back."""
+        pool = _WorkerPool(_try_find_wasmtime(), get_rustpython_cwasm_path(_try_find_wasmtime()), size=1)
+        busy = pool.acquire()
+        pool.close()
+        pool.release(busy)
+
+        assert not busy.alive
+        assert pool.run("print('again')").stdout == b"again\n"
+        assert pool._started == 1
+        assert [w for w in pool._idle.queue if w is not None] != [busy]
+        pool.close()
+
+    def test_failed_replacement_frees_the_slot(self):
+        """Test that a dead worker that can't be replaced does not shrink the pool."""
+        pool = _WorkerPool(_try_find_wasmtime(), get_rustpython_cwasm_path(_try_find_wasmtime()), size=1)
+        worker = pool.acquire()
+        worker.close()
+
+        with patch.object(pool, "_new_worker", side_effect=OSError("no wasmtime")):
+            with pytest.raises(OSError):
+                pool.release(worker)
+
+        assert pool._started == 0
+        # the slot is free again, so this starts a worker instead of blocking
+        assert pool.run("print('again')").stdout == b"again\n"
+        pool.close()
+
+    def test_close_pools_stops_workers(self):
+        """Test that the exit hook stops idle workers, and the pool restarts them."""
+        safe_eval("pass", reuse_process=True)
+        workers = [w for pool in _POOLS.values() for w in list(pool._idle.queue) if w is not None]
+        assert workers
+
+        _close_pools()
+
+        assert not any(w.alive for w in workers)
+        assert safe_eval("print(1)", reuse_process=True).stdout == "1\n"
+
+
+class TestSafeEvalBatch:
+    """Test running several snippets in one wasmtime process."""
+
+    def test_batch_results_in_order(self):
+        """Test that each snippet gets its own result, in order."""
+        results = safe_eval_batch(["print('a')", "undefined_name", "print('c')"])
+
+        assert [r.stdout for r in results] == ["a\n", "", "c\n"]
+        assert [r.returncode == 0 for r in results] == [True, False, True]
+        assert "NameError" in results[1].stderr
+
+    def test_batch_snippets_cannot_reach_the_protocol_streams(self):
+        """Test that sys.__stdout__, sys.stdin and stdout.buffer act as in the one-shot path."""
+        codes = [
+            "import sys; print('hi', file=sys.__stdout__, flush=True)",
+            "x = input()",
+            "import sys; print(repr(sys.stdin.read()))",
+            "import sys; sys.stdout.buffer.write(b'raw\\n')",
+            "print('still in sync')",
+        ]
+        results = safe_eval_batch(codes, timeout=30)
+
+        assert results[0] == ("hi\n", "", 0)
+        assert "EOFError" in results[1].stderr
+        assert results[2].stdout == "''\n"
+        assert results[3] == ("raw\n", "", 0)
+        assert results[4] == ("still in sync\n", "", 0)
+
+    def test_batch_raw_fd_writes_replace_the_worker(self):
+        """Test that bytes written straight to fd 1 are caught, not read as a frame."""
+        forged_header = "b'\\x1eWSE' + bytes(16) + b'\\xff\\xff\\xff\\x7f' + bytes(4)"
+        codes = [
+            "import os; os.write(1, b'junk')",
+            "print('after junk')",
+            f"import os; os.write(1, {forged_header})",
+            "print('after forged header')",
+        ]
+        results = safe_eval_batch(codes, timeout=30)
+
+        assert results[0].returncode != 0
+        assert "malformed response" in results[0].stderr
+        assert results[1] == ("after junk\n", "", 0)
+        assert "malformed response" in results[2].stderr
+        assert results[3] == ("after forged header\n", "", 0)
+
+    def test_batch_empty(self):
+        """Test that an empty batch does not start wasmtime at all."""
+        assert safe_eval_batch([]) == []
+
+
+class TestSafeFuncCallBatch:
+    """Test calling one function with several inputs in one wasmtime process."""
+
+    def test_func_call_batch_results_in_order(self):
+        """Test that each call gets its own result, stderr and returncode."""
+        code = """
+def div(a, b=1):
+    return a / b
+"""
+        results = safe_func_call_batch(code, [([6], {"b": 3}), ([1], {"b": 0}), ([5], {})], "div")
+
+        assert [r.result for r in results[::2]] == [2.0, 5.0]
+        assert results[1].returncode != 0
+        assert results[1].status == FuncCallStatus.NO_RESULT
+        assert "ZeroDivisionError" in results[1].stderr
+        assert results[0].stderr == results[2].stderr == ""
+
+    def test_func_call_batch_matches_single_calls(self):
+        """Test that batched calls agree with safe_func_call."""
+        code = """
+def describe(*args, **kwargs):
+    return {"args": list(args), "kwargs": kwargs}
+"""
+        calls = [([1, "two"], {}), ([], {"k": [None, True]})]
+
+        assert safe_func_call_batch(code, calls, "describe") == [
+            safe_func_call(code, args, kwargs, "describe") for args, kwargs in calls
+        ]
+
+
+class TestSafeEvalParallel:
+    """Test running isolated snippets concurrently on the event loop."""
+
+    def test_async_matches_sync(self):
+        """Test that safe_eval_async gives the same result as safe_eval."""
+        code = "import sys; print('out'); print('err', file=sys.stderr); sys.exit(2)"
+
+        assert asyncio.run(safe_eval_async(code)) == safe_eval(code)
+
+    def test_async_cancel_kills_process(self):
+        """Test that cancelling safe_eval_async does not leave wasmtime running."""
+        spawned = []
+        create = asyncio.create_subprocess_exec
+
+        async def recording_create(*args, **kwargs):
+            process = await create(*args, **kwargs)
+            spawned.append(process)
+            return process
+
+        async def cancel_soon():
+            task = asyncio.ensure_future(safe_eval_async("while True: pass"))
+            while not spawned:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        with patch.object(asyncio, "create_subprocess_exec", recording_create):
+            asyncio.run(cancel_soon())
+
+        assert spawned[0].returncode is not None
+
+    def test_parallel_results_in_order(self):
+        """Test that each snippet gets its own result, in order."""
+        codes = [f"print({i} ** 2)" for i in range(6)] + ["undefined_name"]
+        results = safe_eval_parallel(codes, max_concurrency=3)
+
+        assert [r.stdout for r in results[:-1]] == [f"{i ** 2}\n" for i in range(6)]
+        assert results[-1].returncode != 0
+        assert "NameError" in results[-1].stderr
+
+    def test_parallel_snippets_are_isolated(self):
+        """Test that, unlike safe_eval_batch, snippets do not share an interpreter."""
+        results = safe_eval_parallel(["import sys; sys.leaked = 1", "import sys; print(hasattr(sys, 'leaked'))"])
+
+        assert results[1].stdout == "False\n"
+
+
+class TestBytecodeCache:
+    """Test that large snippets are rerun from cached bytecode."""
+
+    def test_large_snippet_rerun_from_bytecode(self):
+        """Test that a rerun of a large snippet gives the same result from bytecode."""
+        lines = [f"value_{i} = {i} * 2" for i in range(_BYTECODE_MIN_SIZE // 10)]
+        code = "\n".join(lines) + "\nprint('total', value_1 + value_2)\n"
+        cached_before = len(_BYTECODE_CACHE)
+
+        first = safe_eval(code)
+        assert len(_BYTECODE_CACHE) == cached_before + 1
+        second = safe_eval(code)
+
+        assert first == second
+        assert first.stdout == "total 6\n"
+        assert first.returncode == 0
+
+    def test_large_snippet_syntax_error(self):
+        """Test that a large snippet with a syntax error is reported, not cached."""
+        code = "x = 1\n" * (_BYTECODE_MIN_SIZE // 6) + "def broken(:\n"
+        cached_before = len(_BYTECODE_CACHE)
+
+        stdout, stderr, returncode = safe_eval(code)
+
+        assert returncode != 0
+        assert stdout == ""
+        assert "SyntaxError" in stderr
+        assert len(_BYTECODE_CACHE) == cached_before
+
+
+class TestInProcess:
+    """Test running snippets through the wasmtime python package."""
+
+    @pytest.fixture(autouse=True)
+    def require_wasmtime_py(self):
+        pytest.importorskip("wasmtime")
+
+    def test_in_process_runs_snippet(self):
+        """Test that a snippet runs in-process and reports its output."""
+        stdout, stderr, returncode = safe_eval("print('héllo')", in_process=True)
+
+        assert returncode == 0
+        assert stdout == "héllo\n"
+        assert stderr == ""
+
+    def test_in_process_exit_code_and_errors(self):
+        """Test that exit codes and tracebacks come back as with the CLI."""
+        assert safe_eval("import sys; sys.exit(3)", in_process=True).returncode == 3
+
+        _stdout, stderr, returncode = safe_eval("1 / 0", in_process=True)
+        assert returncode != 0
+        assert "ZeroDivisionError" in stderr
+
+    def test_in_process_fresh_interpreter(self):
+        """Test that interpreter state does not leak between in-process calls."""
+        safe_eval("import sys; sys.leaked = 1", in_process=True)
+        stdout, _stderr, _returncode = safe_eval(
+            "import sys; print(hasattr(sys, 'leaked'))", in_process=True
+        )
+
+        assert stdout == "False\n"
+
+    def test_in_process_large_snippet(self):
+        """Test that a snippet larger than a pipe buffer reaches the guest whole."""
+        code = "".join(f"x_{i} = {i}\n" for i in range(20_000)) + "print(x_19999)\n"
+
+        stdout, _stderr, returncode = safe_eval(code, in_process=True)
+
+        assert returncode == 0
+        assert stdout == "19999\n"
+
+    def test_in_process_safe_func_call(self):
+        """Test safe_func_call through the in-process backend."""
+        code = """
+def add(a, b):
+    return a + b
+"""
+        result, _stderr, returncode = safe_func_call(code, [3, 4], {}, "add", in_process=True)
+
+        assert returncode == 0
+        assert result == 7
+
+    def test_in_process_module_is_cached_on_disk(self):
+        """Test that the compiled module is serialized for later processes."""
+        safe_eval("pass", in_process=True)
+
+        assert get_embedded_cwasm_path(get_rustpython_wasm_path()).exists()
+
+    @pytest.mark.parametrize("writable", [True, False])
+    def test_in_process_module_cache_write(self, tmp_path, writable, monkeypatch):
+        """Test that the module is serialized without leftovers, or kept in memory if it cannot be."""
+        wasmtime = pytest.importorskip("wasmtime")
+
+        wasm_path = tmp_path / "tiny.wasm"
+        wasm_path.write_bytes(wasmtime.wat2wasm("(module)"))
+        cache_dir = tmp_path / "cache"
+        if not writable:
+            (tmp_path / "file").write_text("")
+            cache_dir = tmp_path / "file" / "cache"
+        monkeypatch.setattr(_embedded, "CACHE_DIR", cache_dir)
+
+        assert isinstance(_embedded._module.__wrapped__(wasm_path), wasmtime.Module)
+        if writable:
+            assert [p.name for p in cache_dir.iterdir()] == [
+                get_embedded_cwasm_path(wasm_path).name
+            ]
+
+    def test_in_process_excludes_reuse_process(self):
+        """Test that the two process options cannot be combined."""
+        with pytest.raises(ValueError):
+            safe_eval("print(1)", in_process=True, reuse_process=True)
@@ -1,13 +1,23 @@
 """Error handling and edge case tests for wasm-safe-eval."""
 
 import subprocess
-import pytest
-from unittest.mock import patch, MagicMock
 from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
 
-from wasm_safe_eval.safe_eval import safe_eval, safe_func_call, _NoResultSentinel
-from wasm_safe_eval._exceptions import WasmtimeNotFoundError, RustPythonWasmNotFoundError
+from wasm_safe_eval._exceptions import (
+    RustPythonWasmNotFoundError,
+    WasmtimeNotFoundError,
+)
 from wasm_safe_eval._paths import _try_find_wasmtime, get_rustpython_wasm_path
+from wasm_safe_eval.safe_eval import (
+    FuncCallStatus,
+    _NoResultSentinel,
+    safe_eval,
+    safe_eval_bytes,
+    safe_func_call,
+)
 
 
 class TestErrorHandling:
@@ -20,7 +30,7 @@ def broken_function(
     # Missing closing parenthesis and colon
 print("This should fail")
 """
-        stdout, stderr, returncode = safe_eval(code)
+        _stdout, stderr, returncode = safe_eval(code)
         
         assert returncode != 0
         assert stderr != ""
@@ -30,11 +40,12 @@ print("This should fail")
         code = """
 undefined_variable + 5
 """
-        stdout, stderr, returncode = safe_eval(code)
+        _stdout, stderr, returncode = safe_eval(code)
         
         assert returncode != 0
         assert stderr != ""
 
+    @pytest.mark.slow
     def test_infinite_loop_timeout(self):
         """Test that infinite loops don't hang indefinitely."""
         code = """
@@ -44,8 +55,68 @@ while True:
         # This test depends on wasmtime's timeout behavior
         # The subprocess should eventually terminate or timeout
         with pytest.raises(subprocess.TimeoutExpired):
-            stdout, stderr, returncode = safe_eval(code, timeout=1)
+            _stdout, _stderr, _returncode = safe_eval(code, timeout=1)
         
+    @pytest.mark.slow
+    def test_infinite_loop_interrupted_by_wasmtime(self):
+        """Test that the timeout is enforced by wasmtime rather than by killing it."""
+        code = """
+print("started", flush=True)
+while True:
+    pass
+"""
+        with pytest.raises(subprocess.TimeoutExpired) as exc_info:
+            safe_eval(code, timeout=0.5)
+
+        assert exc_info.value.timeout == 0.5
+        assert b"started" in exc_info.value.output
+        assert b"interrupt" in exc_info.value.stderr
+
+    def test_printed_trap_is_not_a_timeout(self):
+        """Test that a guest printing wasmtime's trap text doesn't fake a timeout."""
+        code = r"""
+import sys
+sys.stderr.write("Error: failed to run main module\n\nCaused by:\n    0: wasm trap: interrupt\n")
+sys.exit(1)
+"""
+        _stdout, stderr, returncode = safe_eval(code, timeout=5)
+
+        assert returncode == 1
+        assert "wasm trap: interrupt" in stderr
+
+    @pytest.mark.slow
+    def test_infinite_loop_timeout_reuse_process(self):
+        """Test that a timed-out reused process is replaced for the next call."""
+        code = """
+while True:
+    pass
+"""
+        with pytest.raises(subprocess.TimeoutExpired):
+            safe_eval(code, timeout=1, reuse_process=True)
+
+        stdout, _stderr, returncode = safe_eval("print('still alive')", reuse_process=True)
+        assert returncode == 0
+        assert "still alive" in stdout
+
+    @pytest.mark.slow
+    def test_infinite_loop_timeout_in_process(self):
+        """Test that the in-process backend interrupts an infinite loop."""
+        pytest.importorskip("wasmtime")
+        code = """
+print("started", flush=True)
+while True:
+    pass
+"""
+        with pytest.raises(subprocess.TimeoutExpired) as exc_info:
+            safe_eval(code, timeout=0.5, in_process=True)
+
+        assert exc_info.value.timeout == 0.5
+        assert b"started" in exc_info.value.output
+
+        stdout, _stderr, returncode = safe_eval("print('still alive')", in_process=True)
+        assert returncode == 0
+        assert "still alive" in stdout
+
 #     def test_memory_intensive_operation(self):
 #         """Test handling of memory-intensive operations."""
 #         code = """
@@ -80,7 +151,7 @@ except RecursionError:
 except Exception as e:
     print(f"ERROR: {type(e).__name__}: {e}")
 """
-        stdout, stderr, returncode = safe_eval(code)
+        _stdout, _stderr, _returncode = safe_eval(code)
         
 
     def test_safe_func_call_no_result(self):
@@ -89,23 +160,58 @@ except Exception as e:
 def print_only():
     print("This function doesn't return anything")
 """
-        result, stderr, returncode = safe_func_call(code, [], {}, "print_only")
+        result, _stderr, returncode = safe_func_call(code, [], {}, "print_only")
         
+        # prints do not get in the way, the implicit `None` is the result
+        assert returncode == 0
+        assert result is None
+
+    def test_safe_func_call_unserializable_result(self):
+        """Test safe_func_call when the return value cannot be encoded as JSON."""
+        code = """
+def returns_object():
+    return object()
+"""
+        call = safe_func_call(code, [], {}, "returns_object")
+        result, stderr, returncode = call
+
         # Should return _NoResultSentinel when no result is available
         assert isinstance(result, _NoResultSentinel)
+        assert call.status == FuncCallStatus.NO_RESULT
+        assert returncode != 0
+        assert "TypeError" in stderr
 
     def test_safe_func_call_invalid_json_output(self):
         """Test safe_func_call when function output is not valid JSON."""
         code = """
 def invalid_json_func():
-    # This will cause JSON parsing to fail
+    # printed output is not JSON, but is kept apart from the result
     print("Not JSON output")
     return "some result"
 """
-        result, stderr, returncode = safe_func_call(code, [], {}, "invalid_json_func")
-        
+        call = safe_func_call(code, [], {}, "invalid_json_func")
+        result, stderr, returncode = call
+
+        assert call.status == FuncCallStatus.OK
+        assert returncode == 0
+        assert result == "some result"
+        assert "Error parsing stdout" not in stderr
+
+    def test_safe_func_call_truncated_result_frame(self):
+        """Test safe_func_call when the result frame is cut off."""
+        code = """
+import sys
+
+def truncated_func():
+    sys.stdout.write("\\x1e__WSE_RES__{")
+    sys.exit(0)
+"""
+        call = safe_func_call(code, [], {}, "truncated_func")
+        result, stderr, _returncode = call
+
         # Should return _NoResultSentinel and have error in stderr
         assert isinstance(result, _NoResultSentinel)
+        assert call.status == FuncCallStatus.PARSE_ERROR
         assert "Error parsing stdout" in stderr
 
     def test_safe_func_call_function_not_found(self):
@@ -114,7 +220,7 @@ def invalid_json_func():
 def existing_function():
     return "I exist"
 """
-        result, stderr, returncode = safe_func_call(code, [], {}, "non_existing_function")
+        _result, stderr, returncode = safe_func_call(code, [], {}, "non_existing_function")
         
         # Should fail because function doesn't exist
         assert returncode != 0
@@ -126,7 +232,7 @@ def existing_function():
 def error_function():
     raise ValueError("This function always fails")
 """
-        result, stderr, returncode = safe_func_call(code, [], {}, "error_function")
+        _result, stderr, returncode = safe_func_call(code, [], {}, "error_function")
         
         # Should fail with non-zero return code
         assert returncode != 0
@@ -135,7 +241,7 @@ def error_function():
     def test_empty_code_execution(self):
         """Test execution of empty code."""
         code = ""
-        stdout, stderr, returncode = safe_eval(code)
+        stdout, _stderr, returncode = safe_eval(code)
         
         # Empty code should execute successfully with no output
         assert returncode == 0
@@ -144,11 +250,20 @@ def error_function():
     def test_whitespace_only_code(self):
         """Test execution of whitespace-only code."""
         code = "   \n\t   \n   "
-        stdout, stderr, returncode = safe_eval(code)
+        _stdout, _stderr, returncode = safe_eval(code)
         
         # Whitespace-only code should execute successfully
         assert returncode == 0
 
+    def test_blank_code_skips_wasmtime(self):
+        """Test that blank code returns without starting wasmtime."""
+        with patch("wasm_safe_eval.safe_eval._spawn") as mock_spawn:
+            stdout, stderr, returncode = safe_eval(" \n\t")
+
+        mock_spawn.assert_not_called()
+        assert (stdout, stderr, returncode) == ("", "", 0)
+
+    @pytest.mark.slow
     def test_large_output_handling(self):
         """Test handling of large output."""
         code = """
@@ -156,7 +271,7 @@ def error_function():
 for i in range(1000):
     print(f"Line {i}: " + "x" * 100)
 """
-        stdout, stderr, returncode = safe_eval(code)
+        stdout, _stderr, returncode = safe_eval(code)
         
         # Should handle large output (may be truncated but shouldn't crash)
         assert returncode == 0
@@ -169,13 +284,28 @@ unicode_text = "Hello 世界! 🌍 Привет мир! 🚀"
 print(unicode_text)
 print(f"Length: {len(unicode_text)}")
 """
-        stdout, stderr, returncode = safe_eval(code)
+        stdout, _stderr, returncode = safe_eval_bytes(code)
         
         assert returncode == 0
-        assert "Hello 世界!" in stdout
-        assert "🌍" in stdout
-        assert "Привет мир!" in stdout
-        assert "🚀" in stdout
+        assert "Hello 世界!".encode() in stdout
+        assert "🌍".encode() in stdout
+        assert "Привет мир!".encode() in stdout
+        assert "🚀".encode() in stdout
+
+    def test_unicode_handling_decoded(self):
+        """Test that safe_eval decodes the same Unicode output to str."""
+        stdout, _stderr, returncode = safe_eval('print("Hello 世界! 🌍")')
+
+        assert returncode == 0
+        assert stdout == "Hello 世界! 🌍\n"
+
+    def test_line_endings_translated(self):
+        """Test that safe_eval translates CRLF and CR like text=True, bytes keep them."""
+        code = "import sys; sys.stdout.write('a\\r\\nb\\rc\\n')"
+
+        assert safe_eval(code).stdout == "a\nb\nc\n"
+        assert safe_eval(code, reuse_process=True).stdout == "a\nb\nc\n"
+        assert safe_eval_bytes(code).stdout == b"a\r\nb\rc\n"
 
     def test_safe_func_call_with_complex_args(self):
         """Test safe_func_call with complex argument types."""
@@ -192,7 +322,20 @@ def process_data(data_list, options_dict, multiplier=2):
         args = [[1, 2, 3, 4]]
         kwargs = {"options_dict": {"double": True}, "multiplier": 3}
         
-        result, stderr, returncode = safe_func_call(code, args, kwargs, "process_data")
+        result, _stderr, returncode = safe_func_call(code, args, kwargs, "process_data")
         
         assert returncode == 0
-        assert result == [3, 6, 9, 12]
\ No newline at end of file
+        assert result == [3, 6, 9, 12]
+
+    def test_safe_func_call_with_escaped_string_args(self):
+        """Test safe_func_call with quotes, backslashes and newlines in arguments."""
+        code = """
+def echo(text, suffix=""):
+    return text + suffix
+"""
+        text = 'line 1\nline 2 """ \\ \'quoted\' {braces}'
+
+        result, _stderr, returncode = safe_func_call(code, [text], {"suffix": "\t!"}, "echo")
+
+        assert returncode == 0
+        assert result == text + "\t!"
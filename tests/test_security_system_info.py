@@ -1,6 +1,7 @@
 """Security tests for system information access attempts in WASM sandbox."""
 
 import pytest
+
 from wasm_safe_eval.safe_eval import safe_eval
 
 
@@ -20,7 +21,7 @@ try:
 except Exception as e:
     print(f"BLOCKED: {type(e).__name__}: {e}")
 """
-        stdout, stderr, returncode = safe_eval(code)
+        stdout, _stderr, _returncode = safe_eval(code)
         
         # Should either be blocked or have very limited access
         # WASM environment should not expose host environment variables
@@ -50,7 +51,7 @@ try:
 except Exception as e:
     print(f"BLOCKED: {type(e).__name__}: {e}")
 """
-        stdout, stderr, returncode = safe_eval(code)
+        stdout, _stderr, _returncode = safe_eval(code)
         
         # Should not reveal real host system information
         assert "SUCCESS: Got real system information" not in stdout
@@ -71,7 +72,7 @@ try:
 except Exception as e:
     print(f"BLOCKED: {type(e).__name__}: {e}")
 """
-        stdout, stderr, returncode = safe_eval(code)
+        stdout, stderr, _returncode = safe_eval(code)
         
         # Should not succeed in getting real user information
         assert "SUCCESS:" not in stdout
@@ -98,7 +99,7 @@ try:
 except Exception as e:
     print(f"BLOCKED: {type(e).__name__}: {e}")
 """
-        stdout, stderr, returncode = safe_eval(code)
+        stdout, _stderr, _returncode = safe_eval(code)
         
         # Should not have access to real host /proc filesystem
         assert "PROC_ACCESS:" not in stdout
@@ -113,7 +114,7 @@ try:
 except Exception as e:
     print(f"BLOCKED: {type(e).__name__}: {e}")
 """
-        stdout, stderr, returncode = safe_eval(code)
+        _stdout, _stderr, _returncode = safe_eval(code)
         
         # Memory access should be blocked or limited to WASM process
         # This is acceptable either way, but real host memory info should not be accessible
@@ -137,7 +138,7 @@ try:
 except Exception as e:
     print(f"BLOCKED: {type(e).__name__}: {e}")
 """
-        stdout, stderr, returncode = safe_eval(code)
+        stdout, _stderr, _returncode = safe_eval(code)
         
         # Should not have access to real CPU information via /proc
         assert "CPUINFO_ACCESS:" not in stdout
@@ -153,7 +154,7 @@ try:
 except Exception as e:
     print(f"BLOCKED: {type(e).__name__}: {e}")
 """
-        stdout, stderr, returncode = safe_eval(code)
+        stdout, stderr, _returncode = safe_eval(code)
         
         # Should not succeed in getting real hostname
         assert "SUCCESS:" not in stdout
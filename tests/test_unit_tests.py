@@ -1,81 +1,345 @@
 """Unit tests for individual modules and functions."""
 
-import pytest
-from unittest.mock import patch, MagicMock
-from pathlib import Path
-import tempfile
+import datetime
+import importlib
+import json
+import math
 import os
 import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
 
+import wasm_safe_eval._paths as paths
 from wasm_safe_eval._exceptions import (
-    WasmtimeNotFoundError, 
-    RustPythonWasmNotFoundError, 
-    PlatformNotSupportedError
+    PlatformNotSupportedError,
+    RustPythonWasmNotFoundError,
+    WasmtimeNotFoundError,
+)
+from wasm_safe_eval._paths import (
+    WASMTIME_EXEC,
+    _try_find_wasmtime,
+    get_rustpython_cwasm_path,
+    get_rustpython_wasm_path,
+    get_wasmtime_cache_config,
 )
-from wasm_safe_eval._paths import _try_find_wasmtime, get_rustpython_wasm_path, WASMTIME_EXEC
 from wasm_safe_eval.install_wasmtime import install_wasmtime
+from wasm_safe_eval.safe_eval import _NoResultSentinel, _run_flags, safe_eval
+
+# the package re-exports the `safe_eval` function over the module name
+safe_eval_module = importlib.import_module("wasm_safe_eval.safe_eval")
+
+
+@pytest.fixture(autouse=True)
+def clear_wasmtime_cache():
+    """Keep the cached wasmtime lookup from leaking between mocked tests."""
+    _try_find_wasmtime.cache_clear()
+    yield
+    _try_find_wasmtime.cache_clear()
 
 
 class TestPaths:
     """Test path utility functions."""
 
-    def test_try_find_wasmtime_in_default_location(self):
-        """Test finding wasmtime in default location."""
-        with patch('pathlib.Path.exists', return_value=True):
-            result = _try_find_wasmtime()
-            assert result == WASMTIME_EXEC
+    @pytest.mark.parametrize(
+        "path_exists, which_ret, expected",
+        [
+            pytest.param(True, None, WASMTIME_EXEC, id="default_location"),
+            pytest.param(False, "/usr/bin/wasmtime", "/usr/bin/wasmtime", id="in_path"),
+            pytest.param(False, None, None, id="not_found"),
+        ],
+    )
+    def test_try_find_wasmtime(self, monkeypatch, path_exists, which_ret, expected):
+        """Test finding wasmtime in the default location, then in PATH."""
+        monkeypatch.setattr(Path, "exists", lambda self: path_exists)
+        monkeypatch.setattr(shutil, "which", lambda _: which_ret)
 
-    def test_try_find_wasmtime_in_path(self):
-        """Test finding wasmtime in system PATH."""
-        with patch('pathlib.Path.exists', return_value=False):
-            with patch('shutil.which', return_value='/usr/bin/wasmtime'):
-                result = _try_find_wasmtime()
-                assert result == '/usr/bin/wasmtime'
+        assert _try_find_wasmtime() == expected
 
-    def test_try_find_wasmtime_not_found(self):
-        """Test when wasmtime is not found anywhere."""
+    def test_try_find_wasmtime_is_cached(self):
+        """Test that the PATH search only runs once."""
         with patch('pathlib.Path.exists', return_value=False):
-            with patch('shutil.which', return_value=None):
-                result = _try_find_wasmtime()
-                assert result is None
+            with patch('shutil.which', return_value='/usr/bin/wasmtime') as mock_which:
+                assert _try_find_wasmtime() == '/usr/bin/wasmtime'
+                assert _try_find_wasmtime() == '/usr/bin/wasmtime'
+                mock_which.assert_called_once()
+
+    def test_rustpython_cwasm_path_is_cached(self):
+        """Test that the precompiled module is compiled once and then reused."""
+        wasmtime_exec = _try_find_wasmtime()
+        first = get_rustpython_cwasm_path(wasmtime_exec)
+        assert first.suffix == ".cwasm"
+        assert first.exists()
+
+        with patch('wasm_safe_eval._paths.subprocess.run') as mock_run:
+            second = get_rustpython_cwasm_path(wasmtime_exec)
+            mock_run.assert_not_called()
+        assert second == first
+
+    def test_rustpython_cwasm_path_skips_stat_once_found(self):
+        """Test that a .cwasm found once is not looked up on disk again."""
+        wasmtime_exec = _try_find_wasmtime()
+        first = get_rustpython_cwasm_path(wasmtime_exec)
+
+        with patch('pathlib.Path.exists') as mock_exists:
+            assert get_rustpython_cwasm_path(wasmtime_exec) == first
+            mock_exists.assert_not_called()
+
+    @pytest.mark.parametrize("mode", ["one_shot", "timeout", "reuse_process", "batch"])
+    def test_deleted_cwasm_rebuilt_after_failed_run(self, tmp_path, mode):
+        """Test that a run failing on a deleted .cwasm rebuilds it and retries once."""
+        wasmtime_exec = _try_find_wasmtime()
+        epoch = mode == "timeout"
+        real = get_rustpython_cwasm_path(wasmtime_exec, epoch_interruption=epoch)
+        compiles = []
+
+        def fake_compile(cmd, **kwargs):
+            compiles.append(cmd)
+            shutil.copyfile(real, cmd[cmd.index("-o") + 1])
+            return subprocess.CompletedProcess(cmd, 0, "", "")
+
+        def run():
+            if mode == "batch":
+                return safe_eval_module.safe_eval_batch(["print('ok')"])[0]
+            return safe_eval(
+                "print('ok')",
+                timeout=30 if epoch else None,
+                reuse_process=mode == "reuse_process",
+            )
+
+        with patch.object(paths, "CACHE_DIR", tmp_path), \
+                patch.dict(paths._CWASM_PATHS, clear=True), \
+                patch.dict(safe_eval_module._POOLS, clear=True), \
+                patch.object(paths.subprocess, "run", side_effect=fake_compile):
+            try:
+                assert run().stdout == "ok\n"
+                cached = get_rustpython_cwasm_path(wasmtime_exec, epoch_interruption=epoch)
+                cached.unlink()
+                for pool in safe_eval_module._POOLS.values():
+                    pool.close()
+
+                assert run().stdout == "ok\n"
+            finally:
+                for pool in safe_eval_module._POOLS.values():
+                    pool.close()
+
+        assert cached.exists()
+        assert len(compiles) == 2
+
+    def test_rustpython_cwasm_compiled_once_across_threads(self, tmp_path):
+        """Test that concurrent first calls compile once and all get the .cwasm."""
+        wasmtime_exec = _try_find_wasmtime()
+        paths._cwasm_cache_key(wasmtime_exec, get_rustpython_wasm_path(), ())
+        compiles = []
+
+        def fake_compile(cmd, **kwargs):
+            compiles.append(cmd)
+            time.sleep(0.2)
+            Path(cmd[cmd.index("-o") + 1]).write_bytes(b"compiled")
+            return subprocess.CompletedProcess(cmd, 0, "", "")
+
+        with patch.object(paths, "CACHE_DIR", tmp_path / "cache"), \
+                patch.dict(paths._CWASM_PATHS, clear=True), \
+                patch.object(paths.subprocess, "run", side_effect=fake_compile):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(
+                    lambda _: get_rustpython_cwasm_path(wasmtime_exec), range(4)
+                ))
+
+        assert len(compiles) == 1
+        assert len(set(results)) == 1
+        assert results[0].suffix == ".cwasm"
+        assert results[0].read_bytes() == b"compiled"
+        assert [p.name for p in results[0].parent.iterdir()] == [results[0].name]
+
+    def test_rustpython_cwasm_unwritable_cache_falls_back_to_wasm(self, tmp_path):
+        """Test that an unusable cache dir means running the plain .wasm, not an error."""
+        wasmtime_exec = _try_find_wasmtime()
+        not_a_dir = tmp_path / "file"
+        not_a_dir.write_text("")
+
+        with patch.object(paths, "CACHE_DIR", not_a_dir / "cache"), \
+                patch.dict(paths._CWASM_PATHS, clear=True):
+            assert get_rustpython_cwasm_path(wasmtime_exec) == get_rustpython_wasm_path()
+
+    def test_rustpython_cwasm_path_accepts_str(self):
+        """Test that a str wasm path shares the cached .cwasm of the same Path."""
+        wasmtime_exec = _try_find_wasmtime()
+        wasm_path = get_rustpython_wasm_path()
+
+        assert get_rustpython_cwasm_path(wasmtime_exec, str(wasm_path)) \
+            == get_rustpython_cwasm_path(wasmtime_exec, wasm_path)
+        stdout, _stderr, returncode = safe_eval("print('ok')", wasm_rustpython_path=str(wasm_path))
+        assert returncode == 0
+        assert stdout == "ok\n"
+
+    def test_missing_custom_wasm_path(self, tmp_path):
+        """Test that a custom wasm path that does not exist is reported as such."""
+        missing = tmp_path / "missing.wasm"
+
+        with pytest.raises(RustPythonWasmNotFoundError, match="missing.wasm"):
+            get_rustpython_cwasm_path(_try_find_wasmtime(), missing)
+        with pytest.raises(RustPythonWasmNotFoundError):
+            safe_eval("print('ok')", wasm_rustpython_path=missing)
+
+    def test_missing_custom_wasm_path_in_process(self, tmp_path):
+        """Test that the in-process backend reports a missing custom wasm path too."""
+        pytest.importorskip("wasmtime")
+
+        with pytest.raises(RustPythonWasmNotFoundError):
+            safe_eval("print('ok')", in_process=True, wasm_rustpython_path=str(tmp_path / "missing.wasm"))
+
+    def test_wasm_rustpython_path_is_lazy(self):
+        """Test that WASM_RUSTPYTHON_PATH is resolved on access, not at import."""
+        assert paths.WASM_RUSTPYTHON_PATH == get_rustpython_wasm_path()
+        with pytest.raises(AttributeError):
+            paths.NOT_A_PATH
+
+    def test_wasmtime_cache_config_used_for_plain_wasm(self, tmp_path):
+        """Test that only the plain .wasm fallback runs with wasmtime's cache."""
+        get_wasmtime_cache_config.cache_clear()
+        try:
+            with patch('wasm_safe_eval._paths.CACHE_DIR', tmp_path):
+                flags = _run_flags(Path("rustpython.wasm"))
+                config_path = get_wasmtime_cache_config()
+        finally:
+            get_wasmtime_cache_config.cache_clear()
+
+        assert f"cache-config={config_path}" in flags
+        assert config_path.read_text() == f"[cache]\ndirectory = {str(tmp_path / 'objects')!r}\n"
+        assert "cache=n" in _run_flags(Path("rustpython-0123.cwasm"))
+
+    def test_wasmtime_cache_config_unwritable(self, tmp_path):
+        """Test that an unwritable cache dir means running uncached, not an error."""
+        (tmp_path / "file").write_text("")
+        get_wasmtime_cache_config.cache_clear()
+        try:
+            with patch('wasm_safe_eval._paths.CACHE_DIR', tmp_path / "file" / "cache"):
+                assert get_wasmtime_cache_config() is None
+                flags = _run_flags(Path("rustpython.wasm"))
+        finally:
+            get_wasmtime_cache_config.cache_clear()
+
+        assert "cache=n" in flags
 
 
 
 class TestSafeEvalInternals:
     """Test internal functionality of safe_eval."""
 
-    # def test_temporary_file_cleanup(self):
-    #     """Test that temporary files are properly cleaned up."""
-    #     from wasm_safe_eval.safe_eval import safe_eval
-        
-    #     # Track created temporary files
-    #     original_tempfile = tempfile.NamedTemporaryFile
-    #     temp_files = []
-        
-    #     def mock_tempfile(*args, **kwargs):
-    #         tf = original_tempfile(*args, **kwargs)
-    #         temp_files.append(tf.name)
-    #         return tf
-        
-    #     with patch('tempfile.NamedTemporaryFile', side_effect=mock_tempfile):
-    #         with patch('wasm_safe_eval.safe_eval._try_find_wasmtime', 
-    #                    return_value='/fake/wasmtime'):
-    #             with patch('subprocess.run') as mock_run:
-    #                 mock_run.return_value.stdout = ""
-    #                 mock_run.return_value.stderr = ""
-    #                 mock_run.return_value.returncode = 0
-                    
-    #                 safe_eval("print('test')")
-                    
-    #                 # Check that all temporary files were cleaned up
-    #                 for temp_file in temp_files:
-    #                     assert not os.path.exists(temp_file)
+    def test_no_temporary_files(self):
+        """Test that the one-shot path pipes code through stdin, not a temp file."""
+        with patch('tempfile.NamedTemporaryFile') as mock_named, \
+                patch('tempfile.TemporaryDirectory') as mock_dir, \
+                patch('tempfile.mkstemp') as mock_mkstemp:
+            stdout, _stderr, _returncode = safe_eval("print('test')")
+
+        assert stdout == "test\n"
+        mock_named.assert_not_called()
+        mock_dir.assert_not_called()
+        mock_mkstemp.assert_not_called()
+
+    def test_import_does_not_load_wasmtime_py(self):
+        """Test that importing the package leaves wasmtime-py for `in_process`."""
+        check = "import sys, wasm_safe_eval; print('wasmtime' in sys.modules)"
+        result = subprocess.run(
+            [sys.executable, "-c", check], capture_output=True, text=True
+        )
+        assert result.stdout == "False\n"
+
+    def test_package_exports(self):
+        """Test that `__all__` lists each public name once, and they all import."""
+        package = importlib.import_module("wasm_safe_eval")
+        assert len(package.__all__) == len(set(package.__all__))
+        assert package.FuncCallStatus is safe_eval_module.FuncCallStatus
+        namespace = {}
+        exec("from wasm_safe_eval import *", namespace)
+        assert set(package.__all__) <= set(namespace)
 
     def test_no_result_sentinel(self):
         """Test _NoResultSentinel behavior."""
-        from wasm_safe_eval.safe_eval import _NoResultSentinel
-        
         sentinel = _NoResultSentinel()
         assert "No result returned" in str(sentinel)
         assert "No result returned" in repr(sentinel)
         assert "No result returned" in sentinel.message
+
+    def test_parse_func_call_reads_only_the_frame(self):
+        """Test that only the framed result is parsed, not what was printed before it."""
+        marker = safe_eval_module.RESULT_MARKER.encode()
+        end = safe_eval_module.RESULT_END.encode()
+        printed = b"\xff not utf-8 " + marker + b"not the result" * 1000 + b"\n"
+        output = safe_eval_module.SafeEvalBytesResult(
+            stdout=printed + marker + b'{"a": [1, 2]}' + end, stderr=b"", returncode=0
+        )
+
+        result = safe_eval_module._parse_func_call(output)
+
+        assert result.result == {"a": [1, 2]}
+        assert result.status == safe_eval_module.FuncCallStatus.OK
+
+    @pytest.mark.parametrize("value, expected", [("", 0), ("3", 3), (" 2 ", 2)])
+    def test_pool_size_from_env(self, monkeypatch, value, expected):
+        """Test reading the worker pool size from the environment."""
+        monkeypatch.setenv(safe_eval_module.POOL_SIZE_ENV, value)
+        assert safe_eval_module._pool_size_from_env() == expected
+
+    def test_pool_size_from_env_rejects_garbage(self, monkeypatch):
+        """Test that a non-numeric pool size gives an error naming the variable."""
+        monkeypatch.setenv(safe_eval_module.POOL_SIZE_ENV, "lots")
+        with pytest.raises(ValueError, match=safe_eval_module.POOL_SIZE_ENV):
+            safe_eval_module._pool_size_from_env()
+
+    def test_interrupted_needs_the_trap_last_in_wasmtime_report(self):
+        """Test that only wasmtime's own trailing interrupt trap counts as a timeout."""
+        report = (
+            b"Error: failed to run main module `rustpython.cwasm`\n\n"
+            b"Caused by:\n    0: failed to invoke command default\n"
+            b"    1: error while executing at wasm backtrace:\n"
+            b"    0: 0x9226 - rustpython.wasm!_start\n"
+        )
+        interrupt = report + b"    2: wasm trap: interrupt\n"
+        overflow = report + b"    2: wasm trap: call stack exhausted\n"
+        trap_rc = paths.TRAP_RETURNCODE
+
+        assert safe_eval_module._interrupted(trap_rc, interrupt)
+        assert safe_eval_module._interrupted(
+            trap_rc, interrupt + b"\nStack backtrace:\n   0: main\n"
+        )
+        assert not safe_eval_module._interrupted(1, interrupt)
+        assert not safe_eval_module._interrupted(trap_rc, interrupt + overflow)
+        assert not safe_eval_module._interrupted(trap_rc, b"wasm trap: interrupt\n")
+
+    def test_bare_wasmtime_name_resolved_once(self):
+        """Test that a bare wasmtime_exec is looked up on PATH only once."""
+        safe_eval_module._which.cache_clear()
+        try:
+            with patch('shutil.which', return_value='/opt/bin/wasmtime') as mock_which:
+                assert safe_eval_module._get_wasmtime("wasmtime") == '/opt/bin/wasmtime'
+                assert safe_eval_module._get_wasmtime("wasmtime") == '/opt/bin/wasmtime'
+                assert safe_eval_module._get_wasmtime("/abs/wasmtime") == '/abs/wasmtime'
+                mock_which.assert_called_once_with("wasmtime")
+        finally:
+            safe_eval_module._which.cache_clear()
+
+    @pytest.mark.parametrize("use_orjson", [True, False])
+    def test_json_helpers_match_stdlib(self, use_orjson):
+        """Test the JSON helpers agree with stdlib json, with or without orjson."""
+        orjson = safe_eval_module.orjson if use_orjson else None
+        with patch.object(safe_eval_module, "orjson", orjson):
+            for obj in [[1, "a", None], {"x": [1.5, True]}, {1: "int key"}, 2**70]:
+                assert json.loads(safe_eval_module._json_dumps(obj)) == json.loads(json.dumps(obj))
+            for obj in [[float("nan")], [float("inf"), -float("inf")]]:
+                assert safe_eval_module._json_dumps(obj) == json.dumps(obj)
+            with pytest.raises(TypeError):
+                safe_eval_module._json_dumps([datetime.date(2025, 1, 1)])
+
+            assert safe_eval_module._json_loads('{"a": [1, 2]}') == {"a": [1, 2]}
+            assert math.isnan(safe_eval_module._json_loads("NaN"))
+            with pytest.raises(ValueError):
+                safe_eval_module._json_loads("{")
@@ -1,8 +1,22 @@
-from wasm_safe_eval.safe_eval import safe_eval, safe_func_call
+from wasm_safe_eval.safe_eval import (
+    FuncCallStatus,
+    safe_eval,
+    safe_eval_async,
+    safe_eval_batch,
+    safe_eval_bytes,
+    safe_eval_parallel,
+    safe_func_call,
+    safe_func_call_batch,
+)
 
 __all__ = [
     "safe_eval",
     "install_wasmtime",
     "safe_func_call",
-    "safe_eval",
+    "safe_eval_batch",
+    "safe_eval_bytes",
+    "safe_eval_async",
+    "safe_eval_parallel",
+    "safe_func_call_batch",
+    "FuncCallStatus",
 ]
@@ -0,0 +1,208 @@
+"""in-process backend: run RustPython through the `wasmtime` Python package
+
+instead of spawning the wasmtime CLI, one `Engine`, `Module` and `Linker` are
+kept per host process and every call only creates a fresh `Store`, so each
+snippet still gets its own interpreter and linear memory. needs the optional
+`wasmtime` package: `pip install wasm-safe-eval[embedded]`.
+"""
+
+import contextlib
+import functools
+import importlib.metadata
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+try:
+    import wasmtime
+except ImportError:  # optional, see the `embedded` extra
+    wasmtime = None  # type: ignore[assignment]
+
+from wasm_safe_eval._exceptions import WasmtimeNotFoundError
+from wasm_safe_eval._paths import (
+    CACHE_DIR,
+    TRAP_RETURNCODE,
+    _compile_lock,
+    _compiled_cache_key,
+    _temp_path_for,
+    get_rustpython_wasm_path,
+)
+
+# timeouts are enforced with epoch interruption: a daemon thread bumps the
+# engine's epoch every `_EPOCH_TICK` seconds once the first timed call is made
+_EPOCH_TICK: float = 0.01
+_NO_DEADLINE: int = 1 << 62
+_ticker_lock: threading.Lock = threading.Lock()
+_ticker: threading.Thread | None = None
+
+# WASI only takes stdin from a host path. on Linux that is an anonymous memfd,
+# reopened through `/proc`; elsewhere a temporary file, on tmpfs if there is one
+_USE_MEMFD: bool = hasattr(os, "memfd_create") and os.path.isdir("/proc/self/fd")
+_STDIN_DIR: str | None = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+@functools.lru_cache(maxsize=1)
+def _engine() -> "wasmtime.Engine":
+    if wasmtime is None:
+        raise WasmtimeNotFoundError(
+            "the wasmtime python package is not installed.\n"
+            "Please install it by running: pip install wasm-safe-eval[embedded]"
+        )
+    config: wasmtime.Config = wasmtime.Config()
+    config.epoch_interruption = True
+    return wasmtime.Engine(config)
+
+
+def get_embedded_cwasm_path(wasm_rustpython_path: Path | str) -> Path:
+    """where the module, as compiled by the `wasmtime` package, is cached"""
+    wasm_rustpython_path = Path(wasm_rustpython_path)
+    key: str = _compiled_cache_key(
+        wasm_rustpython_path,
+        f"wasmtime-py {importlib.metadata.version('wasmtime')}",
+        "epoch-interruption",
+    )
+    return CACHE_DIR / f"{wasm_rustpython_path.stem}-py-{key}.cwasm"
+
+
+@functools.cache
+def _module(wasm_rustpython_path: Path) -> "wasmtime.Module":
+    """load `wasm_rustpython_path`, compiling it only on the first ever use
+
+    the compiled module is serialized to `CACHE_DIR` and mapped straight back
+    in by later processes with `Module.deserialize_file`, skipping Cranelift.
+    """
+    engine: wasmtime.Engine = _engine()
+    cwasm_path: Path = get_embedded_cwasm_path(wasm_rustpython_path)
+    # `lru_cache` does not stop threads racing on the first call: one compiles,
+    # the others wait for it and then load what it wrote
+    with _compile_lock(cwasm_path):
+        if cwasm_path.exists():
+            try:
+                return wasmtime.Module.deserialize_file(engine, str(cwasm_path))
+            except wasmtime.WasmtimeError:
+                # written by an incompatible build, compile it again below
+                pass
+
+        module: wasmtime.Module = wasmtime.Module.from_file(
+            engine, str(wasm_rustpython_path)
+        )
+        # write to a unique temporary name first so no caller sees a partial file
+        try:
+            temp_path: Path = _temp_path_for(cwasm_path)
+        except OSError:
+            # e.g. an unwritable `CACHE_DIR`: keep the module in memory only
+            return module
+        try:
+            temp_path.write_bytes(module.serialize())
+            os.replace(temp_path, cwasm_path)
+        except OSError:
+            pass
+        finally:
+            with contextlib.suppress(OSError):
+                temp_path.unlink(missing_ok=True)
+        return module
+
+
+@functools.lru_cache(maxsize=1)
+def _linker() -> "wasmtime.Linker":
+    linker: wasmtime.Linker = wasmtime.Linker(_engine())
+    linker.define_wasi()
+    return linker
+
+
+def _tick(engine: "wasmtime.Engine") -> None:
+    while True:
+        time.sleep(_EPOCH_TICK)
+        engine.increment_epoch()
+
+
+def _start_ticker() -> None:
+    global _ticker
+    with _ticker_lock:
+        if _ticker is None:
+            _ticker = threading.Thread(
+                target=_tick,
+                args=(_engine(),),
+                name="wasm-safe-eval-epoch",
+                daemon=True,
+            )
+            _ticker.start()
+
+
+def _set_stdin(wasi: "wasmtime.WasiConfig", data: bytes) -> None:
+    """make `data` the guest's stdin
+
+    `WasiConfig.stdin_file` opens the path right away, so the memfd or file is
+    closed (and gone) again before the guest even starts.
+    """
+    if _USE_MEMFD:
+        fd: int = os.memfd_create("wasm-safe-eval-stdin", os.MFD_CLOEXEC)
+        try:
+            view: memoryview = memoryview(data)
+            while view:
+                view = view[os.write(fd, view) :]
+            wasi.stdin_file = f"/proc/self/fd/{fd}"
+        finally:
+            os.close(fd)
+        return
+
+    with tempfile.NamedTemporaryFile(dir=_STDIN_DIR) as stdin_file:
+        stdin_file.write(data)
+        stdin_file.flush()
+        wasi.stdin_file = stdin_file.name
+
+
+def run_in_process(
+    code: str,
+    bootstrap: str,
+    timeout: float | None,
+    wasm_rustpython_path: Path | str | None = None,
+) -> tuple[bytes, bytes, int]:
+    """run `code` in a fresh `Store`, returning (stdout, stderr, returncode)
+
+    `bootstrap` is passed to RustPython as `-c` and reads `code` from stdin.
+    raises `subprocess.TimeoutExpired` if `timeout` seconds pass first.
+    """
+    if wasm_rustpython_path is None:
+        wasm_rustpython_path = get_rustpython_wasm_path()
+    else:
+        wasm_rustpython_path = Path(wasm_rustpython_path)
+    module: wasmtime.Module = _module(wasm_rustpython_path)
+    stdout: bytearray = bytearray()
+    stderr: bytearray = bytearray()
+
+    wasi: wasmtime.WasiConfig = wasmtime.WasiConfig()
+    wasi.argv = ["rustpython", "-c", bootstrap]
+    wasi.stdout_custom = stdout.extend
+    wasi.stderr_custom = stderr.extend
+    _set_stdin(wasi, code.encode("utf-8"))
+
+    store: wasmtime.Store = wasmtime.Store(_engine())
+    store.set_wasi(wasi)
+    if timeout is None:
+        store.set_epoch_deadline(_NO_DEADLINE)
+    else:
+        _start_ticker()
+        store.set_epoch_deadline(max(1, int(timeout / _EPOCH_TICK)))
+
+    returncode: int = 0
+    try:
+        instance: wasmtime.Instance = _linker().instantiate(store, module)
+        instance.exports(store)["_start"](store)  # type: ignore[operator]
+    except wasmtime.ExitTrap as e:
+        returncode = e.code
+    except wasmtime.Trap as e:
+        if e.trap_code == wasmtime.TrapCode.INTERRUPT and timeout is not None:
+            raise subprocess.TimeoutExpired(
+                str(wasm_rustpython_path),
+                timeout,
+                output=bytes(stdout),
+                stderr=bytes(stderr),
+            ) from e
+        stderr += f"Error: {e}\n".encode()
+        returncode = TRAP_RETURNCODE
+
+    return bytes(stdout), bytes(stderr), returncode
@@ -1,15 +1,34 @@
-from pathlib import Path
+import contextlib
+import functools
+import hashlib
+import os
+import platform
 import shutil
+import subprocess
+import tempfile
+import threading
 from importlib.resources import files
+from pathlib import Path
 
 from wasm_safe_eval._exceptions import RustPythonWasmNotFoundError
 
 # Default paths
 WASMTIME_EXEC: str = str(Path.home() / ".wasmtime" / "bin" / "wasmtime")
+CACHE_DIR: Path = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "wasm-safe-eval"
+)
+
+# exit code of the wasmtime CLI when the guest traps (an abort); a guest can't
+# exit with this itself, since wasmtime turns any exit status of 126 or more into 1
+TRAP_RETURNCODE: int = 3 if os.name == "nt" else 128 + 6
 
 
+@functools.lru_cache(maxsize=1)
 def _try_find_wasmtime() -> str | None:
-    """Try to find the wasmtime executable in the default location."""
+    """Try to find the wasmtime executable in the default location.
+
+    The result is cached, call `_try_find_wasmtime.cache_clear()` to look again.
+    """
     if Path(WASMTIME_EXEC).exists():
         return WASMTIME_EXEC
     else:
@@ -17,6 +36,7 @@ def _try_find_wasmtime() -> str | None:
         return wasmtime_in_path
 
 
+@functools.lru_cache(maxsize=1)
 def get_rustpython_wasm_path() -> Path:
     """Get the path to the bundled rustpython.wasm file."""
     output: Path = Path(str(files("wasm_safe_eval").joinpath("rustpython.wasm")))
@@ -27,4 +47,189 @@ def get_rustpython_wasm_path() -> Path:
     return output
 
 
-WASM_RUSTPYTHON_PATH: Path = get_rustpython_wasm_path()
+def __getattr__(name: str) -> Path:
+    # `WASM_RUSTPYTHON_PATH` is resolved on first access rather than at import
+    if name == "WASM_RUSTPYTHON_PATH":
+        return get_rustpython_wasm_path()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@functools.lru_cache(maxsize=1)
+def get_wasmtime_cache_config() -> Path | None:
+    """Write (once) a wasmtime cache config pointing into `CACHE_DIR`.
+
+    Only needed for runs of the plain `.wasm`, when precompiling it failed:
+    `wasmtime run -C cache-config=...` then reuses its compiled code across
+    processes instead of running Cranelift on every call. Returns `None` if
+    the config cannot be written, e.g. with an unwritable `CACHE_DIR`.
+    """
+    config_path: Path = CACHE_DIR / "wasmtime-cache.toml"
+    objects_dir: Path = CACHE_DIR / "objects"
+    config: str = f"[cache]\ndirectory = {str(objects_dir)!r}\n"
+    with _compile_lock(config_path):
+        try:
+            if config_path.exists() and config_path.read_text() == config:
+                return config_path
+            temp_path: Path = _temp_path_for(config_path)
+        except OSError:
+            return None
+        try:
+            temp_path.write_text(config)
+            os.replace(temp_path, config_path)
+        except OSError:
+            return None
+        finally:
+            with contextlib.suppress(OSError):
+                temp_path.unlink(missing_ok=True)
+    return config_path
+
+
+# compiles in the epoch checks behind `wasmtime run -W timeout=...`. a module
+# built with these traps immediately when run without a deadline, so it is kept
+# as a separate `.cwasm` used only for calls with a timeout
+EPOCH_INTERRUPTION_FLAGS: tuple[str, ...] = ("-W", "epoch-interruption=y")
+
+
+_COMPILE_LOCKS: dict[Path, threading.Lock] = {}
+_COMPILE_LOCKS_LOCK: threading.Lock = threading.Lock()
+
+
+def _compile_lock(output: Path) -> threading.Lock:
+    """The lock a thread must hold to build `output`, so it is only built once."""
+    with _COMPILE_LOCKS_LOCK:
+        return _COMPILE_LOCKS.setdefault(output, threading.Lock())
+
+
+def _temp_path_for(output: Path) -> Path:
+    """Create a fresh, unique file next to `output`, to be `os.replace`d onto it.
+
+    Raises `OSError` if `output`'s directory cannot be created or written to.
+    """
+    output.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp_name = tempfile.mkstemp(
+        dir=output.parent, prefix=f".{output.name}.", suffix=".tmp"
+    )
+    os.close(fd)
+    return Path(temp_name)
+
+
+def _compiled_cache_key(wasm_path: Path, *tags: str) -> str:
+    """Hash the wasm bytes, host architecture and `tags` (compiler version, flags).
+
+    Raises `RustPythonWasmNotFoundError` if `wasm_path` does not exist.
+    """
+    digest = hashlib.sha256(" ".join([platform.machine(), *tags]).encode("utf-8"))
+    try:
+        with open(wasm_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    except FileNotFoundError as e:
+        raise RustPythonWasmNotFoundError(
+            f"The RustPython wasm module could not be found at {wasm_path}"
+        ) from e
+    return digest.hexdigest()[:16]
+
+
+@functools.cache
+def _cwasm_cache_key(
+    wasmtime_exec: str,
+    wasm_rustpython_path: Path,
+    compile_flags: tuple[str, ...] = (),
+) -> str:
+    """Hash the wasm bytes, wasmtime version and flags a `.cwasm` is only valid for."""
+    version: str = subprocess.run(
+        [wasmtime_exec, "--version"],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.strip()
+    return _compiled_cache_key(wasm_rustpython_path, version, *compile_flags)
+
+
+# `.cwasm` files already known to exist, so repeat calls skip the `stat`
+_CWASM_PATHS: dict[tuple[str, Path, bool], Path] = {}
+
+
+def get_rustpython_cwasm_path(
+    wasmtime_exec: str,
+    wasm_rustpython_path: Path | str | None = None,
+    epoch_interruption: bool = False,
+) -> Path:
+    """Get the path to a precompiled `.cwasm` of `wasm_rustpython_path`.
+
+    The module is compiled with `wasmtime compile` on first use and stored in
+    `CACHE_DIR`, keyed by the hash of the wasm bytes, the wasmtime version and
+    the compile flags, so later runs skip Cranelift entirely. Pass
+    `epoch_interruption=True` for the variant that supports `-W timeout`. If
+    compilation fails, the original wasm path is returned (wasmtime still
+    accepts it under `--allow-precompiled`). Once a `.cwasm` has been found it
+    is returned straight from memory, without checking the disk again; a caller
+    whose run fails on a `.cwasm` that has since been deleted drops it with
+    `_forget_cwasm_path` and calls this again to rebuild it.
+    """
+    if wasm_rustpython_path is None:
+        wasm_rustpython_path = get_rustpython_wasm_path()
+    else:
+        # `str` paths are coerced so they share the memo with the same `Path`
+        wasm_rustpython_path = Path(wasm_rustpython_path)
+    known: Path | None = _CWASM_PATHS.get(
+        (wasmtime_exec, wasm_rustpython_path, epoch_interruption)
+    )
+    if known is not None:
+        return known
+    compile_flags: tuple[str, ...] = (
+        EPOCH_INTERRUPTION_FLAGS if epoch_interruption else ()
+    )
+    key: str = _cwasm_cache_key(wasmtime_exec, wasm_rustpython_path, compile_flags)
+    output: Path = CACHE_DIR / f"{wasm_rustpython_path.stem}-{key}.cwasm"
+    # one thread compiles, the others wait for it and then find the file
+    with _compile_lock(output):
+        if not output.exists():
+            try:
+                _compile_cwasm(
+                    wasmtime_exec, wasm_rustpython_path, compile_flags, output
+                )
+            except OSError:
+                # e.g. an unwritable `CACHE_DIR`: run the plain wasm instead
+                return wasm_rustpython_path
+        if not output.exists():
+            return wasm_rustpython_path
+    _CWASM_PATHS[wasmtime_exec, wasm_rustpython_path, epoch_interruption] = output
+    return output
+
+
+def _forget_cwasm_path(cwasm_path: Path) -> None:
+    """Drop `cwasm_path` from the in-memory lookup, so it is checked again."""
+    for lookup_key, known in list(_CWASM_PATHS.items()):
+        if known == cwasm_path:
+            _CWASM_PATHS.pop(lookup_key, None)
+
+
+def _compile_cwasm(
+    wasmtime_exec: str,
+    wasm_rustpython_path: Path,
+    compile_flags: tuple[str, ...],
+    output: Path,
+) -> None:
+    """Compile `wasm_rustpython_path` to `output`, leaving it absent on failure."""
+    # compile to a unique temporary name first so no caller sees a partial file
+    temp_output: Path = _temp_path_for(output)
+    try:
+        completed: subprocess.CompletedProcess[str] = subprocess.run(
+            [
+                wasmtime_exec,
+                "compile",
+                *compile_flags,
+                str(wasm_rustpython_path),
+                "-o",
+                str(temp_output),
+            ],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        if completed.returncode == 0:
+            os.replace(temp_output, output)
+    finally:
+        with contextlib.suppress(OSError):
+            temp_output.unlink(missing_ok=True)
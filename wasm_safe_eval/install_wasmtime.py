@@ -7,19 +7,46 @@ import shutil
 import sys
 
 from wasm_safe_eval._exceptions import PlatformNotSupportedError
-from wasm_safe_eval._paths import _try_find_wasmtime
+from wasm_safe_eval._paths import (
+    _try_find_wasmtime,
+    get_rustpython_cwasm_path,
+    get_rustpython_wasm_path,
+)
 
 
-_DIV: str = "=" * shutil.get_terminal_size().columns
 SOURCE_URL: str = "https://wasmtime.dev/install.sh"
 
 
+def precompile_rustpython(wasmtime_exec: str) -> None:
+    """Compile `rustpython.wasm` ahead of time, so the first `safe_eval` is fast.
+
+    Both `.cwasm` variants used by the CLI path are built, plus the one for the
+    in-process backend if the `wasmtime` python package is installed.
+    """
+    print("Precompiling rustpython.wasm, this can take a minute...", flush=True)
+    for epoch_interruption in (False, True):
+        cwasm_path = get_rustpython_cwasm_path(
+            wasmtime_exec, epoch_interruption=epoch_interruption
+        )
+        print(f"  {cwasm_path}", flush=True)
+
+    from wasm_safe_eval import _embedded
+
+    if _embedded.wasmtime is not None:
+        _embedded._module(get_rustpython_wasm_path())
+        print(
+            f"  {_embedded.get_embedded_cwasm_path(get_rustpython_wasm_path())}",
+            flush=True,
+        )
+
+
 def install_wasmtime(confirm: bool = False) -> None:
     f"""Install wasmtime from {SOURCE_URL}"""
     # see if it's already installed
     wasmtime_exec: str | None = _try_find_wasmtime()
     if wasmtime_exec:
         print(f"exiting: wasmtime already installed at: {wasmtime_exec}")
+        precompile_rustpython(wasmtime_exec)
         return
 
     # Check platform
@@ -43,24 +70,30 @@ def install_wasmtime(confirm: bool = False) -> None:
             sys.exit(0)
 
     # Run the official wasmtime installer
+    # (the divider is sized here, not at import, so importing this module stays cheap)
+    div: str = "=" * shutil.get_terminal_size(fallback=(80, 24)).columns
     print("Installing wasmtime...")
-    print(_DIV)
+    print(div)
 
     print(f"$ {cmd}")
-    print(_DIV, flush=True)
+    print(div, flush=True)
     result: subprocess.CompletedProcess = subprocess.run(cmd, shell=True)
 
     # check and return
     if result.returncode != 0:
-        print(_DIV, file=sys.stderr, flush=True)
+        print(div, file=sys.stderr, flush=True)
         raise RuntimeError(f"Failed to install wasmtime: {result.stderr}")
 
-    print(_DIV, flush=True)
+    print(div, flush=True)
+    _try_find_wasmtime.cache_clear()
     print(
         f"wasmtime installed successfully to: {_try_find_wasmtime() = }\n"
         "You may need to restart your terminal for changes to take effect.",
         flush=True,
     )
+    wasmtime_exec = _try_find_wasmtime()
+    if wasmtime_exec:
+        precompile_rustpython(wasmtime_exec)
 
 
 if __name__ == "__main__":
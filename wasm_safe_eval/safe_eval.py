@@ -1,11 +1,34 @@
+import atexit
+import collections
+import enum
+import functools
+import hashlib
 import json
+import math
+import os
+import queue
+import selectors
+import shutil
+import struct
 import subprocess
-import tempfile
+import threading
+import time
 from pathlib import Path
 from typing import Any, NamedTuple
 
-from wasm_safe_eval._paths import WASM_RUSTPYTHON_PATH, _try_find_wasmtime
 from wasm_safe_eval._exceptions import WasmtimeNotFoundError
+from wasm_safe_eval._paths import (
+    TRAP_RETURNCODE,
+    _forget_cwasm_path,
+    _try_find_wasmtime,
+    get_rustpython_cwasm_path,
+    get_wasmtime_cache_config,
+)
+
+try:
+    import orjson
+except ImportError:  # optional, see the `fast` extra
+    orjson = None  # type: ignore[assignment]
 
 
 class SafeEvalResult(NamedTuple):
@@ -16,12 +39,842 @@ class SafeEvalResult(NamedTuple):
     returncode: int
 
 
+class SafeEvalBytesResult(NamedTuple):
+    """Result of a safe evaluation, with the output left undecoded."""
+
+    stdout: bytes
+    stderr: bytes
+    returncode: int
+
+    def decode(self) -> SafeEvalResult:
+        """decode both streams as UTF-8, replacing invalid bytes
+
+        line endings are translated as with `text=True`: CRLF and a bare CR
+        both come back as LF
+        """
+        return SafeEvalResult(
+            stdout=_decode_text(self.stdout),
+            stderr=_decode_text(self.stderr),
+            returncode=self.returncode,
+        )
+
+
+def _decode_text(data: bytes) -> str:
+    """decode like `subprocess` does with `text=True`: universal newlines"""
+    text: str = data.decode("utf-8", errors="replace")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+# large reads keep big outputs down to a handful of syscalls
+_READ_SIZE: int = 1 << 20
+
+# wasmtime interrupts the guest itself when a timeout is set; the host only
+# kills the process if it has not exited this long after the deadline
+_TIMEOUT_GRACE: float = 1.0
+_INTERRUPT_TRAP: bytes = b"wasm trap: interrupt"
+_RUN_ERROR: bytes = b"Error: failed to run main module"
+
+# the guest gets no preopened directories and no sockets
+_WASI_RUN_FLAGS: tuple[str, ...] = (
+    "-S",
+    "nn=n",
+    "-S",
+    "tcp=n",
+    "-S",
+    "udp=n",
+)
+
+
+def _run_flags(module_path: Path) -> list[str]:
+    """`wasmtime run` flags for `module_path`, up to `--allow-precompiled`
+
+    a `.cwasm` needs no compiling, so wasmtime's own cache is skipped for it;
+    the plain `.wasm` fallback uses the cache in `CACHE_DIR` instead, if that
+    can be written.
+    """
+    cache: str = "cache=n"
+    if module_path.suffix != ".cwasm":
+        cache_config: Path | None = get_wasmtime_cache_config()
+        if cache_config is not None:
+            cache = f"cache-config={cache_config}"
+    return ["run", "-C", cache, *_WASI_RUN_FLAGS, "--allow-precompiled"]
+
+
+@functools.lru_cache(maxsize=8)
+def _cmd_prefix(wasmtime_exec: str, module_path: Path) -> tuple[tuple[str, ...], str]:
+    """the invariant parts of a command running `module_path`, built once
+
+    returns (wasmtime and its run flags, the module argument); per-call flags
+    such as the timeout go between the two.
+    """
+    return (wasmtime_exec, *_run_flags(module_path)), str(module_path)
+
+
+# one-shot snippets are read from stdin instead of a script file, so no
+# `--dir` preopen is needed
+STDIN_BOOTSTRAP: str = (
+    'exec(compile(__import__("sys").stdin.read(), "<string>", "exec"),'
+    ' {"__name__": "__main__"})'
+)
+
+# larger snippets are compiled by the guest, which sends the marshalled code
+# object back ahead of any output, `_BYTECODE_HEADER`-prefixed; later runs of
+# the same source ship that bytecode in place of the source, skipping the parse
+_BYTECODE_HEADER: struct.Struct = struct.Struct("<Q")
+
+COMPILE_BOOTSTRAP: str = f"""
+import marshal, struct, sys
+_code = compile(sys.stdin.read(), "<string>", "exec")
+_bytecode = marshal.dumps(_code)
+sys.stdout.buffer.write(struct.pack({_BYTECODE_HEADER.format!r}, len(_bytecode)) + _bytecode)
+sys.stdout.buffer.flush()
+del _bytecode
+exec(_code, {{"__name__": "__main__"}})
+"""
+
+MARSHAL_BOOTSTRAP: str = (
+    "import marshal, sys\n"
+    'exec(marshal.loads(sys.stdin.buffer.read()), {"__name__": "__main__"})'
+)
+
+# snippets shorter than this parse in well under a millisecond, not worth it
+_BYTECODE_MIN_SIZE: int = 4096
+_BYTECODE_CACHE_SIZE: int = 64
+_BYTECODE_CACHE: collections.OrderedDict[str, bytes] = collections.OrderedDict()
+_BYTECODE_CACHE_LOCK: threading.Lock = threading.Lock()
+
+
+def _bytecode_key(module_path: Path, code: str) -> str:
+    """cache key for the bytecode of `code` as compiled by `module_path`"""
+    return hashlib.sha256(f"{module_path}\0{code}".encode()).hexdigest()
+
+
+def _get_bytecode(key: str) -> bytes | None:
+    with _BYTECODE_CACHE_LOCK:
+        bytecode: bytes | None = _BYTECODE_CACHE.get(key)
+        if bytecode is not None:
+            _BYTECODE_CACHE.move_to_end(key)
+        return bytecode
+
+
+def _store_bytecode(key: str, bytecode: bytes) -> None:
+    with _BYTECODE_CACHE_LOCK:
+        _BYTECODE_CACHE[key] = bytecode
+        while len(_BYTECODE_CACHE) > _BYTECODE_CACHE_SIZE:
+            _BYTECODE_CACHE.popitem(last=False)
+
+
+def _split_bytecode(
+    stdout: bytes | bytearray,
+) -> tuple[bytes | None, bytes | bytearray]:
+    """split what `COMPILE_BOOTSTRAP` wrote into (bytecode, user stdout)
+
+    stdout is empty if compiling failed; the bytecode is `None` then, or if
+    the guest was stopped before it was written out in full.
+    """
+    if len(stdout) < _BYTECODE_HEADER.size:
+        return None, stdout
+    (length,) = _BYTECODE_HEADER.unpack_from(stdout)
+    end: int = _BYTECODE_HEADER.size + length
+    if len(stdout) < end:
+        return None, b""
+    return bytes(stdout[_BYTECODE_HEADER.size : end]), stdout[end:]
+
+
+def _spawn(cmd: list[str]) -> subprocess.Popen[bytes]:
+    """start `cmd` with all three standard streams piped
+
+    no shell, no `preexec_fn` and the default `close_fds=True` keep CPython on
+    its vfork fast path, so spawning does not copy the host's page tables.
+    (`posix_spawn` would need `close_fds=False`, and measured slower here.)
+    """
+    return subprocess.Popen(
+        cmd,
+        executable=cmd[0],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        shell=False,
+        close_fds=True,
+    )
+
+
+def _communicate(
+    process: subprocess.Popen[bytes],
+    timeout: float | None = None,
+    input: bytes | None = None,
+) -> tuple[bytearray, bytearray]:
+    """read stdout and stderr of `process` until both hit EOF, then reap it
+
+    `input`, if given, is written to stdin (which is then closed) first.
+    kills the process and raises `subprocess.TimeoutExpired` once `timeout`
+    seconds have passed, like `subprocess.run` would.
+    """
+    assert process.stdout is not None
+    assert process.stderr is not None
+    start: float = time.monotonic()
+    if process.stdin is not None:
+        try:
+            if input:
+                process.stdin.write(input)
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+    stdout_fd: int = process.stdout.fileno()
+    stderr_fd: int = process.stderr.fileno()
+    buffers: dict[int, bytearray] = {stdout_fd: bytearray(), stderr_fd: bytearray()}
+
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(stdout_fd, selectors.EVENT_READ)
+            selector.register(stderr_fd, selectors.EVENT_READ)
+            while selector.get_map():
+                wait: float | None = None
+                if timeout is not None:
+                    wait = timeout - (time.monotonic() - start)
+                    if wait <= 0:
+                        process.kill()
+                        raise subprocess.TimeoutExpired(process.args, timeout)
+                for key, _ in selector.select(wait):
+                    chunk: bytes = os.read(key.fd, _READ_SIZE)
+                    if chunk:
+                        buffers[key.fd] += chunk
+                    else:
+                        selector.unregister(key.fd)
+    finally:
+        process.wait()
+        process.stdout.close()
+        process.stderr.close()
+
+    return buffers[stdout_fd], buffers[stderr_fd]
+
+
+# RustPython-side request loop run by `_WasmtimeServer`: reads
+# `{len} {nonce}\n{code}` frames from stdin, executes each in fresh globals, and
+# answers on stdout with one `_RESPONSE_HEADER` (magic, nonce, returncode,
+# len_stdout, len_stderr) followed by the captured stdout and stderr, so the
+# host reads a single stream and slices it.
+# while a snippet runs, every `sys` stream (the `__dunder__` ones included) points
+# at per-snippet buffers, and `sys.stdin`, `os.read(0, n)` and `open(0)` read
+# as empty, as in the one-shot path. exit statuses are mapped the way the
+# RustPython and wasmtime CLIs map them. this only keeps well-behaved snippets
+# apart and the framing intact: the snippet runs in the same interpreter as the
+# loop, so it can still reach the protocol pipes and the nonce (through
+# `sys._getframe`, or fd 0 via `_io.FileIO`) or patch builtins for the next
+# snippet. workers are isolated from the host, not from each other -- only run
+# snippets you trust not to interfere with each other on the same worker
+_RESPONSE_HEADER: struct.Struct = struct.Struct("<4s8sqII")
+_RESPONSE_MAGIC: bytes = b"\x1eWSE"
+_NONCE_SIZE: int = 8
+# a header announcing more than this is treated as garbage, not waited for
+_MAX_RESPONSE_SIZE: int = 1 << 31
+
+SERVER_DRIVER: str = f"""
+import builtins
+import io
+import os
+import posix
+import struct
+import sys
+import traceback
+
+
+class _Capture(io.BytesIO):
+    # a snippet closing `sys.stdout` must not lose what it wrote
+    def close(self):
+        pass
+
+
+def _captured(stream, raw):
+    try:
+        stream.flush()
+    except Exception:
+        pass
+    return raw.getvalue()
+
+
+def _exit_status(e, err):
+    # RustPython exits 0 for an int outside 0-255, wasmtime turns 126-255 into 1
+    code = None if not e.args else e.args[0] if len(e.args) == 1 else e.args
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        if not 0 <= code <= 255:
+            return 0
+        return 1 if code >= 126 else code
+    print(code, file=err)
+    return 1
+
+
+def _read(fd, n, _read=os.read):
+    # fd 0 is the protocol pipe, the snippet sees it as already at EOF
+    return b"" if fd == 0 else _read(fd, n)
+
+
+def _open(file, mode="r", *args, _open=io.open, **kwargs):
+    if file == 0:
+        return io.BytesIO() if "b" in mode else io.StringIO()
+    return _open(file, mode, *args, **kwargs)
+
+
+def _serve():
+    protocol_in = sys.stdin.buffer
+    protocol_out = sys.stdout.buffer
+    real_streams = (
+        sys.stdin, sys.stdout, sys.stderr, sys.__stdin__, sys.__stdout__, sys.__stderr__
+    )
+    real_read, real_open = os.read, builtins.open
+    compile_, exec_, pack = compile, exec, struct.pack
+    print_exc = traceback.print_exc
+
+    while True:
+        header = protocol_in.readline()
+        if not header:
+            break
+        size, nonce = header.split()
+        nonce = bytes.fromhex(nonce.decode("ascii"))
+        code = protocol_in.read(int(size)).decode("utf-8")
+
+        out_raw, err_raw = _Capture(), _Capture()
+        out = io.TextIOWrapper(out_raw, encoding="utf-8", newline="\\n")
+        err = io.TextIOWrapper(err_raw, encoding="utf-8", newline="\\n")
+        snippet_in = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        sys.stdin = sys.__stdin__ = snippet_in
+        sys.stdout = sys.__stdout__ = out
+        sys.stderr = sys.__stderr__ = err
+        os.read = posix.read = _read
+        builtins.open = io.open = _open
+        returncode = 0
+        try:
+            exec_(compile_(code, "<string>", "exec"), {{"__name__": "__main__"}})
+        except SystemExit as e:
+            returncode = _exit_status(e, err)
+        except BaseException:
+            print_exc(file=err)
+            returncode = 1
+        finally:
+            (
+                sys.stdin, sys.stdout, sys.stderr,
+                sys.__stdin__, sys.__stdout__, sys.__stderr__,
+            ) = real_streams
+            os.read = posix.read = real_read
+            builtins.open = io.open = real_open
+
+        out_bytes = _captured(out, out_raw)
+        err_bytes = _captured(err, err_raw)
+        header = pack(
+            {_RESPONSE_HEADER.format!r},
+            {_RESPONSE_MAGIC!r},
+            nonce,
+            returncode,
+            len(out_bytes),
+            len(err_bytes),
+        )
+        protocol_out.write(header + out_bytes + err_bytes)
+        protocol_out.flush()
+
+
+_serve()
+"""
+
+
+class _WasmtimeServer:
+    """a long-lived wasmtime process running RustPython in a request loop
+
+    the module is loaded and the interpreter started once, so only the first
+    request pays for process startup. every snippet gets fresh globals, but the
+    interpreter itself (imported modules, `sys` state) is shared by all snippets
+    run on the same server -- use the one-shot path when that matters.
+    """
+
+    def __init__(self, wasmtime_exec: str, module_path: Path) -> None:
+        prefix, module_arg = _cmd_prefix(wasmtime_exec, module_path)
+        self.cmd: list[str] = [*prefix, module_arg, "-c", SERVER_DRIVER]
+        self.process: subprocess.Popen[bytes] = _spawn(self.cmd)
+        self._lock: threading.Lock = threading.Lock()
+        # set by `_WorkerPool`, workers from before its last `close` are stale
+        self.generation: int = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def close(self) -> None:
+        """kill the wasmtime process and release its pipes"""
+        if self.alive:
+            self.process.kill()
+        self.process.wait()
+        for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+            if pipe is not None:
+                pipe.close()
+
+    def run(self, code: str, timeout: float | None = None) -> SafeEvalBytesResult:
+        """execute `code` in the running interpreter
+
+        if the deadline passes, the process is killed and
+        `subprocess.TimeoutExpired` is raised, as with the one-shot path. if the
+        process dies mid-request (for example on a wasm trap), its stderr and
+        exit code are returned instead. a response that is not exactly one
+        well-formed frame for this request (say, the snippet wrote to fd 1
+        directly) also stops the process, and an error is returned.
+        """
+        with self._lock:
+            assert self.process.stdin is not None
+            payload: bytes = code.encode("utf-8")
+            nonce: bytes = os.urandom(_NONCE_SIZE)
+            try:
+                self.process.stdin.write(
+                    b"%d %s\n" % (len(payload), nonce.hex().encode()) + payload
+                )
+                self.process.stdin.flush()
+            except BrokenPipeError:
+                pass
+            return self._read_response(nonce, timeout)
+
+    def _protocol_error(self) -> SafeEvalBytesResult:
+        """stop the process after a malformed response, it cannot be trusted"""
+        self.close()
+        return SafeEvalBytesResult(
+            stdout=b"",
+            stderr=b"wasm-safe-eval: malformed response from the worker process "
+            b"(did the code write to file descriptor 1 directly?), it was stopped\n",
+            returncode=1,
+        )
+
+    def _read_response(
+        self, nonce: bytes, timeout: float | None
+    ) -> SafeEvalBytesResult:
+        assert self.process.stdout is not None
+        assert self.process.stderr is not None
+        start: float = time.monotonic()
+        stdout_fd: int = self.process.stdout.fileno()
+        stderr_fd: int = self.process.stderr.fileno()
+        buffers: dict[int, bytearray] = {stdout_fd: bytearray(), stderr_fd: bytearray()}
+        expected: int | None = None
+        header_len: int = _RESPONSE_HEADER.size
+
+        with selectors.DefaultSelector() as selector:
+            selector.register(stdout_fd, selectors.EVENT_READ)
+            selector.register(stderr_fd, selectors.EVENT_READ)
+            while selector.get_map():
+                wait: float | None = None
+                if timeout is not None:
+                    wait = timeout - (time.monotonic() - start)
+                    if wait <= 0:
+                        self.close()
+                        raise subprocess.TimeoutExpired(self.cmd, timeout)
+                for key, _ in selector.select(wait):
+                    chunk: bytes = os.read(key.fd, _READ_SIZE)
+                    if not chunk:
+                        selector.unregister(key.fd)
+                        continue
+                    buffers[key.fd] += chunk
+
+                stdout_buf: bytearray = buffers[stdout_fd]
+                if expected is None and len(stdout_buf) >= header_len:
+                    magic, frame_nonce, returncode, n_out, n_err = (
+                        _RESPONSE_HEADER.unpack_from(stdout_buf)
+                    )
+                    if (
+                        magic != _RESPONSE_MAGIC
+                        or frame_nonce != nonce
+                        or n_out + n_err > _MAX_RESPONSE_SIZE
+                    ):
+                        return self._protocol_error()
+                    expected = header_len + n_out + n_err
+                if expected is not None and len(stdout_buf) >= expected:
+                    if len(stdout_buf) > expected:
+                        return self._protocol_error()
+                    body: bytes = bytes(stdout_buf[header_len:expected])
+                    return SafeEvalBytesResult(
+                        stdout=body[:n_out],
+                        stderr=body[n_out:],
+                        returncode=returncode,
+                    )
+
+        # both pipes hit EOF before a full response: the process died
+        self.process.wait()
+        return SafeEvalBytesResult(
+            stdout=b"",
+            stderr=bytes(buffers[stderr_fd]),
+            returncode=self.process.returncode,
+        )
+
+
+# environment variable overriding the default number of workers per pool
+POOL_SIZE_ENV: str = "WASM_SAFE_EVAL_POOL_SIZE"
+
+
+def _pool_size_from_env() -> int:
+    """`$WASM_SAFE_EVAL_POOL_SIZE`, or 0 if it is unset or empty"""
+    value: str = os.environ.get(POOL_SIZE_ENV, "0").strip() or "0"
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(
+            f"${POOL_SIZE_ENV} must be a whole number of workers, got {value!r}"
+        ) from None
+
+
+class _WorkerPool:
+    """a pool of `_WasmtimeServer` workers for one wasmtime/module pair
+
+    workers are started lazily, up to `size` of them, and each one serves a
+    single caller at a time, so concurrent calls run in parallel rather than
+    queueing on one process. a worker that timed out or died is replaced.
+
+    `size` defaults to `$WASM_SAFE_EVAL_POOL_SIZE`, or the number of CPUs.
+    """
+
+    def __init__(
+        self,
+        wasmtime_exec: str,
+        module_path: Path,
+        size: int | None = None,
+    ) -> None:
+        self.wasmtime_exec: str = wasmtime_exec
+        self.module_path: Path = module_path
+        self.size: int = size or _pool_size_from_env() or os.cpu_count() or 1
+        # `None` only wakes a waiting `acquire`, see `release`
+        self._idle: queue.Queue[_WasmtimeServer | None] = queue.Queue()
+        self._started: int = 0
+        self._generation: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def _new_worker(self, generation: int) -> _WasmtimeServer:
+        worker: _WasmtimeServer = _WasmtimeServer(self.wasmtime_exec, self.module_path)
+        worker.generation = generation
+        return worker
+
+    def _replace_worker(self, dead: _WasmtimeServer) -> _WasmtimeServer:
+        """start a worker in place of `dead`, giving its slot up if that fails"""
+        dead.close()
+        try:
+            return self._new_worker(dead.generation)
+        except BaseException:
+            with self._lock:
+                if self._generation == dead.generation:
+                    self._started -= 1
+            # let a waiting `acquire` retry the slot
+            self._idle.put(None)
+            raise
+
+    def acquire(self) -> _WasmtimeServer:
+        """take an idle worker, starting a new one if the pool is not full yet"""
+        while True:
+            worker: _WasmtimeServer | None
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    spawn: bool = self._started < self.size
+                    if spawn:
+                        self._started += 1
+                    generation: int = self._generation
+                if spawn:
+                    try:
+                        return self._new_worker(generation)
+                    except BaseException:
+                        with self._lock:
+                            if self._generation == generation:
+                                self._started -= 1
+                        raise
+                worker = self._idle.get()
+            if worker is not None and worker.generation == self._generation:
+                break
+            if worker is not None:
+                worker.close()
+
+        if not worker.alive:
+            worker = self._replace_worker(worker)
+        return worker
+
+    def release(self, worker: _WasmtimeServer) -> None:
+        """hand a worker back, replacing it if it was killed or died
+
+        a worker acquired before the last `close` is stopped instead: it no
+        longer counts towards `size`, so a waiting `acquire` may start a new one.
+        """
+        if worker.generation != self._generation:
+            worker.close()
+            self._idle.put(None)
+            return
+        if not worker.alive:
+            worker = self._replace_worker(worker)
+        self._idle.put(worker)
+
+    def run(self, code: str, timeout: float | None = None) -> SafeEvalBytesResult:
+        """run `code` on the next free worker"""
+        worker: _WasmtimeServer = self.acquire()
+        try:
+            return worker.run(code, timeout)
+        finally:
+            self.release(worker)
+
+    def close(self) -> None:
+        """stop all idle workers, and the busy ones once they are released"""
+        with self._lock:
+            self._generation += 1
+            self._started = 0
+        wakeups: int = 0
+        while True:
+            try:
+                worker: _WasmtimeServer | None = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if worker is None:
+                wakeups += 1
+            else:
+                worker.close()
+        for _ in range(wakeups):
+            self._idle.put(None)
+
+
+_POOLS: dict[tuple[str, str], _WorkerPool] = {}
+_POOLS_LOCK: threading.Lock = threading.Lock()
+
+
+def _get_pool(wasmtime_exec: str, module_path: Path) -> _WorkerPool:
+    """get the worker pool for this wasmtime/module pair, creating it if needed"""
+    key: tuple[str, str] = (wasmtime_exec, str(module_path))
+    with _POOLS_LOCK:
+        pool: _WorkerPool | None = _POOLS.get(key)
+        if pool is None:
+            pool = _WorkerPool(wasmtime_exec, module_path)
+            _POOLS[key] = pool
+        return pool
+
+
+@atexit.register
+def _close_pools() -> None:
+    """stop the idle workers of every pool, so none outlive the host process"""
+    with _POOLS_LOCK:
+        pools: list[_WorkerPool] = list(_POOLS.values())
+    for pool in pools:
+        pool.close()
+
+
+@functools.cache
+def _which(command: str) -> str | None:
+    """`shutil.which`, cached: `_get_wasmtime` runs on every call"""
+    return shutil.which(command)
+
+
+def _get_wasmtime(wasmtime_exec: str | None) -> str:
+    """return `wasmtime_exec`, or look up the installed wasmtime if it is `None`
+
+    a bare command name is resolved against `PATH` here and memoized by
+    `_which`, so neither this nor the spawned child searches `PATH` on every
+    call. the default lookup is cached by `_try_find_wasmtime` in the same way.
+    """
+    if wasmtime_exec is None:
+        wasmtime_exec = _try_find_wasmtime()
+        if wasmtime_exec is None:
+            raise WasmtimeNotFoundError(
+                "wasmtime executable not found.\n"
+                "Please install it by running: python -m wasm_safe_eval.install_wasmtime"
+            )
+    elif not os.path.dirname(wasmtime_exec):
+        wasmtime_exec = _which(wasmtime_exec) or wasmtime_exec
+    return wasmtime_exec
+
+
+def _evict_vanished_cwasm(module_path: Path, returncode: int) -> bool:
+    """after a failed run, forget `module_path` if it was a `.cwasm` since deleted
+
+    returns whether it was, in which case the caller rebuilds it and retries
+    once. only failures `stat` the file, successful runs trust the lookup.
+    """
+    if returncode == 0 or module_path.suffix != ".cwasm" or module_path.exists():
+        return False
+    _forget_cwasm_path(module_path)
+    return True
+
+
+def _one_shot_cmd(
+    code: str,
+    timeout: float | None,
+    wasmtime_exec: str,
+    module_path: Path,
+) -> tuple[list[str], bytes, str, str | None]:
+    """build the command for running `code` on a fresh wasmtime process
+
+    `module_path` must support `-W timeout` if `timeout` is set. returns (cmd,
+    stdin payload, bootstrap, bytecode cache key or `None`)
+    """
+    prefix, module_arg = _cmd_prefix(wasmtime_exec, module_path)
+    cmd: list[str] = [*prefix]
+    if timeout is not None:
+        # epoch-based: wasmtime traps the guest once the deadline passes
+        cmd += ["-W", f"timeout={max(1, math.ceil(timeout * 1000))}ms"]
+
+    # large snippets run from cached bytecode, or are compiled by the guest so
+    # that the next run can
+    bootstrap: str = STDIN_BOOTSTRAP
+    payload: bytes | None = None
+    bytecode_key: str | None = None
+    if len(code) >= _BYTECODE_MIN_SIZE:
+        bytecode_key = _bytecode_key(module_path, code)
+        payload = _get_bytecode(bytecode_key)
+        bootstrap = COMPILE_BOOTSTRAP if payload is None else MARSHAL_BOOTSTRAP
+    if payload is None:
+        payload = code.encode("utf-8")
+    cmd += [module_arg, "-c", bootstrap]
+    return cmd, payload, bootstrap, bytecode_key
+
+
+def _interrupted(returncode: int, stderr: bytes | bytearray) -> bool:
+    """whether wasmtime stopped the guest because its timeout ran out
+
+    the trap must be the last cause in wasmtime's own error report, which comes
+    after anything the guest wrote to stderr, so a guest printing the trap text
+    is not enough. the report is `Error: ...`, a blank line, the `Caused by:`
+    chain, and then the host backtrace if `RUST_BACKTRACE` is set.
+    """
+    if returncode != TRAP_RETURNCODE:
+        return False
+    start: int = stderr.rfind(_RUN_ERROR)
+    if start == -1:
+        return False
+    sections: list[bytes] = bytes(stderr[start:]).split(b"\n\n")
+    return len(sections) > 1 and sections[1].rstrip().endswith(_INTERRUPT_TRAP)
+
+
+def _one_shot_result(
+    cmd: list[str],
+    timeout: float | None,
+    bootstrap: str,
+    bytecode_key: str | None,
+    stdout: bytes | bytearray,
+    stderr: bytes | bytearray,
+    returncode: int,
+) -> SafeEvalBytesResult:
+    """turn the output of a `_one_shot_cmd` process into a result"""
+    if bootstrap is COMPILE_BOOTSTRAP:
+        assert bytecode_key is not None
+        bytecode, stdout = _split_bytecode(stdout)
+        if bytecode is not None:
+            _store_bytecode(bytecode_key, bytecode)
+
+    if timeout is not None and _interrupted(returncode, stderr):
+        raise subprocess.TimeoutExpired(
+            cmd, timeout, output=bytes(stdout), stderr=bytes(stderr)
+        )
+
+    return SafeEvalBytesResult(
+        stdout=bytes(stdout),
+        stderr=bytes(stderr),
+        returncode=returncode,
+    )
+
+
+def safe_eval_bytes(
+    code: str,
+    timeout: float | None = None,
+    wasmtime_exec: str | None = None,
+    wasm_rustpython_path: Path | None = None,
+    reuse_process: bool = False,
+    in_process: bool = False,
+) -> SafeEvalBytesResult:
+    """like `safe_eval`, but returns stdout and stderr as raw bytes
+
+    skips decoding when the caller only searches or forwards the output.
+
+    # Parameters:
+    - `code : str`
+        code to execute
+    - `wasmtime_exec : str`
+        (defaults to `WASMTIME_EXEC`)
+    - `wasm_rustpython_path : Path`
+        (defaults to `WASM_RUSTPYTHON_PATH`)
+    - `reuse_process : bool`
+        run the code on a long-lived worker from a `_WorkerPool` instead of a
+        fresh wasmtime process. much faster for many small snippets, but snippets
+        on the same worker share one interpreter, so they are not isolated from
+        each other.
+        (defaults to `False`)
+    - `in_process : bool`
+        run the code through the `wasmtime` python package inside this process
+        rather than through the wasmtime CLI. skips process startup, and every
+        call still gets a fresh interpreter. needs `wasm-safe-eval[embedded]`.
+        (defaults to `False`)
+
+    # Returns:
+    - `SafeEvalBytesResult`
+        (stdout, stderr, returncode), with stdout and stderr as `bytes`
+    """
+    if reuse_process and in_process:
+        raise ValueError("`reuse_process` and `in_process` cannot both be set")
+
+    if in_process:
+        if not code.strip():
+            return SafeEvalBytesResult(stdout=b"", stderr=b"", returncode=0)
+        # imported here so the other modes don't pay for loading wasmtime-py
+        from wasm_safe_eval._embedded import run_in_process
+
+        return SafeEvalBytesResult(
+            *run_in_process(code, STDIN_BOOTSTRAP, timeout, wasm_rustpython_path)
+        )
+
+    # Get wasmtime executable if not provided
+    wasmtime_exec = _get_wasmtime(wasmtime_exec)
+
+    # blank code is a no-op, no need to start wasmtime for it
+    if not code.strip():
+        return SafeEvalBytesResult(stdout=b"", stderr=b"", returncode=0)
+
+    # modules are precompiled once and cached on disk, see `get_rustpython_cwasm_path`.
+    # the workers are interrupted by the host, only one-shot runs need epochs
+    epoch_interruption: bool = timeout is not None and not reuse_process
+    module_path: Path = get_rustpython_cwasm_path(
+        wasmtime_exec, wasm_rustpython_path, epoch_interruption
+    )
+    result: SafeEvalBytesResult = _run_module(
+        code, timeout, wasmtime_exec, module_path, reuse_process
+    )
+    if _evict_vanished_cwasm(module_path, result.returncode):
+        module_path = get_rustpython_cwasm_path(
+            wasmtime_exec, wasm_rustpython_path, epoch_interruption
+        )
+        result = _run_module(code, timeout, wasmtime_exec, module_path, reuse_process)
+    return result
+
+
+def _run_module(
+    code: str,
+    timeout: float | None,
+    wasmtime_exec: str,
+    module_path: Path,
+    reuse_process: bool,
+) -> SafeEvalBytesResult:
+    """run `code` on `module_path`, on a pooled worker or a fresh process"""
+    if reuse_process:
+        return _get_pool(wasmtime_exec, module_path).run(code, timeout)
+
+    cmd, payload, bootstrap, bytecode_key = _one_shot_cmd(
+        code, timeout, wasmtime_exec, module_path
+    )
+    process: subprocess.Popen[bytes] = _spawn(cmd)
+    stdout, stderr = _communicate(
+        process,
+        None if timeout is None else timeout + _TIMEOUT_GRACE,
+        input=payload,
+    )
+    return _one_shot_result(
+        cmd, timeout, bootstrap, bytecode_key, stdout, stderr, process.returncode
+    )
+
+
 # TODO: add maximum memory usage via `ulimit`
 def safe_eval(
     code: str,
     timeout: float | None = None,
     wasmtime_exec: str | None = None,
-    wasm_rustpython_path: Path = WASM_RUSTPYTHON_PATH,
+    wasm_rustpython_path: Path | None = None,
+    reuse_process: bool = False,
+    in_process: bool = False,
 ) -> tuple[str, str, int]:
     """safely execute a Python code snippet in a WebAssembly RustPython environment.
 
@@ -32,81 +885,301 @@ def safe_eval(
         (defaults to `WASMTIME_EXEC`)
     - `wasm_rustpython_path : Path`
         (defaults to `WASM_RUSTPYTHON_PATH`)
+    - `reuse_process : bool`
+        run the code on a long-lived worker from a `_WorkerPool` instead of a
+        fresh wasmtime process. much faster for many small snippets, but snippets
+        on the same worker share one interpreter, so they are not isolated from
+        each other.
+        (defaults to `False`)
+    - `in_process : bool`
+        run the code through the `wasmtime` python package inside this process
+        rather than through the wasmtime CLI. skips process startup, and every
+        call still gets a fresh interpreter. needs `wasm-safe-eval[embedded]`.
+        (defaults to `False`)
 
     # Returns:
     - `tuple[str, str, int]`
         (stdout, stderr, returncode)
     """
+    return safe_eval_bytes(
+        code=code,
+        timeout=timeout,
+        wasmtime_exec=wasmtime_exec,
+        wasm_rustpython_path=wasm_rustpython_path,
+        reuse_process=reuse_process,
+        in_process=in_process,
+    ).decode()
 
-    # Get wasmtime executable if not provided
-    if wasmtime_exec is None:
-        wasmtime_exec = _try_find_wasmtime()
-        if wasmtime_exec is None:
-            raise WasmtimeNotFoundError(
-                "wasmtime executable not found.\n"
-                "Please install it by running: python -m wasm_safe_eval.install_wasmtime"
-            )
 
-    # Write code to temporary file for secure execution
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_file_path: Path = Path(temp_dir) / "script.py"
+def safe_eval_batch(
+    codes: list[str],
+    timeout: float | None = None,
+    wasmtime_exec: str | None = None,
+    wasm_rustpython_path: Path | None = None,
+) -> list[SafeEvalResult]:
+    """execute several snippets one after another in a single wasmtime process
+
+    pays for process and interpreter startup once instead of once per snippet.
+    each snippet gets fresh globals, but they share one interpreter, so they are
+    not isolated from each other -- use `safe_eval` for that.
+
+    # Parameters:
+    - `codes : list[str]`
+        snippets to execute, in order
+    - `timeout : float | None`
+        limit for each snippet, raises `subprocess.TimeoutExpired` if exceeded
+    - `wasmtime_exec : str`
+        (defaults to `WASMTIME_EXEC`)
+    - `wasm_rustpython_path : Path`
+        (defaults to `WASM_RUSTPYTHON_PATH`)
+
+    # Returns:
+    - `list[SafeEvalResult]`
+        one (stdout, stderr, returncode) per snippet
+    """
+    return [
+        result.decode()
+        for result in _run_batch(codes, timeout, wasmtime_exec, wasm_rustpython_path)
+    ]
 
-        temp_file_path.write_text(code, encoding="utf-8")
 
-        cmd: list[str] = [
+def _run_batch(
+    codes: list[str],
+    timeout: float | None,
+    wasmtime_exec: str | None,
+    wasm_rustpython_path: Path | None,
+) -> list[SafeEvalBytesResult]:
+    """`safe_eval_batch`, without decoding the output"""
+    wasmtime_exec = _get_wasmtime(wasmtime_exec)
+
+    module_path: Path = get_rustpython_cwasm_path(wasmtime_exec, wasm_rustpython_path)
+    results: list[SafeEvalBytesResult] = []
+    server: _WasmtimeServer | None = None
+    try:
+        for code in codes:
+            # a snippet that crashed the process should not take the rest with it
+            if server is None or not server.alive:
+                server = _WasmtimeServer(wasmtime_exec, module_path)
+            result: SafeEvalBytesResult = server.run(code, timeout)
+            if _evict_vanished_cwasm(module_path, result.returncode):
+                server.close()
+                module_path = get_rustpython_cwasm_path(
+                    wasmtime_exec, wasm_rustpython_path
+                )
+                server = _WasmtimeServer(wasmtime_exec, module_path)
+                result = server.run(code, timeout)
+            results.append(result)
+    finally:
+        if server is not None:
+            server.close()
+
+    return results
+
+
+async def safe_eval_async(
+    code: str,
+    timeout: float | None = None,
+    wasmtime_exec: str | None = None,
+    wasm_rustpython_path: Path | None = None,
+) -> SafeEvalResult:
+    """like `safe_eval`, but awaits the wasmtime process instead of blocking
+
+    every call still gets its own process, so awaiting several of these at once
+    (see `safe_eval_parallel`) runs them side by side on the event loop.
+
+    # Parameters:
+    - `code : str`
+        code to execute
+    - `timeout : float | None`
+        raises `subprocess.TimeoutExpired` if exceeded
+    - `wasmtime_exec : str`
+        (defaults to `WASMTIME_EXEC`)
+    - `wasm_rustpython_path : Path`
+        (defaults to `WASM_RUSTPYTHON_PATH`)
+
+    # Returns:
+    - `SafeEvalResult`
+        (stdout, stderr, returncode)
+    """
+    # imported here, it is slow to load and only needed by the async API
+    import asyncio
+
+    wasmtime_exec = _get_wasmtime(wasmtime_exec)
+
+    if not code.strip():
+        return SafeEvalResult(stdout="", stderr="", returncode=0)
+
+    # may compile the `.cwasm` or run `wasmtime --version`, keep that off the loop
+    epoch_interruption: bool = timeout is not None
+    module_path: Path = await asyncio.to_thread(
+        get_rustpython_cwasm_path,
+        wasmtime_exec,
+        wasm_rustpython_path,
+        epoch_interruption,
+    )
+    result: SafeEvalBytesResult = await _run_one_shot_async(
+        code, timeout, wasmtime_exec, module_path
+    )
+    if _evict_vanished_cwasm(module_path, result.returncode):
+        module_path = await asyncio.to_thread(
+            get_rustpython_cwasm_path,
             wasmtime_exec,
-            f"--dir={temp_dir}",
-            str(wasm_rustpython_path),
-            str(temp_file_path),
-        ]
-
-        completed: subprocess.CompletedProcess[str] = subprocess.run(
-            cmd,
-            text=True,  # decode to str instead of bytes
-            capture_output=True,  # capture both stdout and stderr
-            check=False,  # do not raise on non‑zero exit
-            timeout=timeout,  # apply timeout if specified
+            wasm_rustpython_path,
+            epoch_interruption,
         )
+        result = await _run_one_shot_async(code, timeout, wasmtime_exec, module_path)
+    return result.decode()
 
-    return SafeEvalResult(
-        stdout=completed.stdout,
-        stderr=completed.stderr,
-        returncode=completed.returncode,
+
+async def _run_one_shot_async(
+    code: str,
+    timeout: float | None,
+    wasmtime_exec: str,
+    module_path: Path,
+) -> SafeEvalBytesResult:
+    """`_run_module` for a fresh process, awaiting it on the event loop"""
+    import asyncio
+
+    cmd, payload, bootstrap, bytecode_key = _one_shot_cmd(
+        code, timeout, wasmtime_exec, module_path
+    )
+    process: asyncio.subprocess.Process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
     )
+    try:
+        stdout, stderr = await asyncio.wait_for(
+            process.communicate(payload),
+            None if timeout is None else timeout + _TIMEOUT_GRACE,
+        )
+    except BaseException as e:
+        # also on cancellation, or the wasmtime process outlives the task
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+        await process.wait()
+        if isinstance(e, TimeoutError):
+            assert timeout is not None
+            raise subprocess.TimeoutExpired(cmd, timeout) from None
+        raise
+    assert process.returncode is not None
+
+    return _one_shot_result(
+        cmd, timeout, bootstrap, bytecode_key, stdout, stderr, process.returncode
+    )
+
+
+def safe_eval_parallel(
+    codes: list[str],
+    timeout: float | None = None,
+    wasmtime_exec: str | None = None,
+    wasm_rustpython_path: Path | None = None,
+    max_concurrency: int | None = None,
+) -> list[SafeEvalResult]:
+    """run each of `codes` on its own wasmtime process, several at a time
+
+    unlike `safe_eval_batch` every snippet is isolated from the others. must be
+    called from synchronous code -- inside an event loop, gather
+    `safe_eval_async` directly instead.
+
+    # Parameters:
+    - `codes : list[str]`
+        snippets to execute
+    - `timeout : float | None`
+        limit for each snippet, raises `subprocess.TimeoutExpired` if exceeded
+    - `wasmtime_exec : str`
+        (defaults to `WASMTIME_EXEC`)
+    - `wasm_rustpython_path : Path`
+        (defaults to `WASM_RUSTPYTHON_PATH`)
+    - `max_concurrency : int | None`
+        most wasmtime processes running at once
+        (defaults to `os.cpu_count()`)
+
+    # Returns:
+    - `list[SafeEvalResult]`
+        one (stdout, stderr, returncode) per snippet, in the order of `codes`
+    """
+    import asyncio
+
+    if max_concurrency is None:
+        max_concurrency = os.cpu_count() or 1
+
+    async def run_all() -> list[SafeEvalResult]:
+        semaphore: asyncio.Semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run_one(code: str) -> SafeEvalResult:
+            async with semaphore:
+                return await safe_eval_async(
+                    code, timeout, wasmtime_exec, wasm_rustpython_path
+                )
+
+        return list(await asyncio.gather(*(run_one(code) for code in codes)))
+
+    return asyncio.run(run_all())
+
+
+def _json_dumps(obj: Any) -> str:
+    """`json.dumps`, always from the stdlib
 
+    `orjson` is not used here: it writes `NaN`/`Infinity` as `null` and encodes
+    types such as `datetime`, dataclasses, `UUID` and enums that `json.dumps`
+    rejects, so the guest would see different arguments with the `fast` extra
+    """
+    return json.dumps(obj)
+
+
+def _json_loads(data: str | bytes) -> Any:
+    """`json.loads`, via `orjson` when it is installed and can decode `data`"""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # e.g. `NaN`/`Infinity`, which the guest's `json.dumps` emits
+            pass
+    return json.loads(data)
+
+
+# written (with the closing `RESULT_END`) around the JSON-encoded return value, as
+# the last thing on stdout. `json.dumps` escapes control characters, so neither
+# can appear inside the payload, and anything the function prints comes before it
+RESULT_MARKER: str = "\x1e__WSE_RES__"
+RESULT_END: str = "\x1e"
+_RESULT_MARKER_BYTES: bytes = RESULT_MARKER.encode("utf-8")
+_RESULT_END_BYTES: bytes = RESULT_END.encode("utf-8")
 
-FUNC_CALL_TEMPLATE: str = '''
+FUNC_CALL_HEADER: str = """
 # implemented function
 # ==============================
-{func_code}
+"""
+
+# fixed wrapper, byte-identical for every call: it goes after the user code (so
+# `from __future__` imports there still work) and only the short call line at
+# the end depends on `func_name` and the arguments
+FUNC_CALL_PRELUDE: str = f"""
 # ==============================
 
 # wrapper
 # ==============================
-import json
-
-
-# get args and kwargs from JSON
-
-args: list = json.loads("""
-{args}
-""")
+def __wse_run(func, call_payload):
+    import json as _json
+    import sys as _sys
 
-kwargs: dict = json.loads("""
-{kwargs}
-""")
-
-# call the function
-result = {func_name}(*args, **kwargs)
-print(json.dumps(result))
-'''
+    # get args and kwargs from a single JSON payload
+    args, kwargs = _json.loads(call_payload)
+    result = func(*args, **kwargs)
+    _sys.stdout.write({RESULT_MARKER!r} + _json.dumps(result) + {RESULT_END!r})
+"""
 
 
 class _NoResultSentinel:
     """Sentinel object to indicate no result was returned from the function call."""
 
-    def __init__(self):
-        self.message = "No result returned from function call."
+    def __init__(self, message: str = "No result returned from function call."):
+        self.message = message
 
     def __repr__(self):
         return f"_NoResultSentinel({self.message!r})"
@@ -115,6 +1188,22 @@ class _NoResultSentinel:
         return self.message
 
 
+# shared instances, so `FuncCallResult.status` is an identity check and no
+# sentinel is allocated per call
+_NO_RESULT: _NoResultSentinel = _NoResultSentinel()
+_PARSE_ERROR: _NoResultSentinel = _NoResultSentinel(
+    "No result returned from function call: the result could not be parsed."
+)
+
+
+class FuncCallStatus(enum.IntEnum):
+    """how the result of a `safe_func_call` was obtained"""
+
+    OK = 0
+    NO_RESULT = 1
+    PARSE_ERROR = 2
+
+
 class FuncCallResult(NamedTuple):
     """Result of a function call in a WebAssembly RustPython environment."""
 
@@ -122,6 +1211,15 @@ class FuncCallResult(NamedTuple):
     stderr: str
     returncode: int
 
+    @property
+    def status(self) -> FuncCallStatus:
+        """`OK` if `result` holds the return value, otherwise why it does not"""
+        if self.result is _NO_RESULT:
+            return FuncCallStatus.NO_RESULT
+        if self.result is _PARSE_ERROR:
+            return FuncCallStatus.PARSE_ERROR
+        return FuncCallStatus.OK
+
 
 def safe_func_call(
     code: str,
@@ -130,30 +1228,87 @@ def safe_func_call(
     func_name: str,
     timeout: float | None = None,
     wasmtime_exec: str | None = None,
-    wasm_rustpython_path: Path = WASM_RUSTPYTHON_PATH,
-) -> tuple[Any, str, int]:
-    """safely call a function in a WebAssembly RustPython environment."""
+    wasm_rustpython_path: Path | None = None,
+    reuse_process: bool = False,
+    in_process: bool = False,
+) -> FuncCallResult:
+    """safely call a function in a WebAssembly RustPython environment.
 
-    code_augmented: str = FUNC_CALL_TEMPLATE.format(
-        func_code=code,
-        args=json.dumps(args),
-        kwargs=json.dumps(kwargs),
-        func_name=func_name,
-    )
+    `FuncCallResult.status` tells a real return value apart from a missing
+    (`NO_RESULT`) or unparseable (`PARSE_ERROR`) one.
+    """
 
-    stdout, stderr, returncode = safe_eval(
-        code=code_augmented,
+    output: SafeEvalBytesResult = safe_eval_bytes(
+        code=_func_call_code(code, args, kwargs, func_name),
         timeout=timeout,
         wasmtime_exec=wasmtime_exec,
         wasm_rustpython_path=wasm_rustpython_path,
+        reuse_process=reuse_process,
+        in_process=in_process,
     )
+    return _parse_func_call(output)
 
-    result = _NoResultSentinel()
-    try:
-        if returncode == 0 and stdout:
-            result = json.loads(stdout)
-    except Exception as e:
-        stderr += f"\nError parsing stdout: {e}"
+
+def safe_func_call_batch(
+    code: str,
+    calls: list[tuple[list, dict]],
+    func_name: str,
+    timeout: float | None = None,
+    wasmtime_exec: str | None = None,
+    wasm_rustpython_path: Path | None = None,
+) -> list[FuncCallResult]:
+    """call `func_name` once per `(args, kwargs)` in `calls`, in a single wasmtime process
+
+    the calls run through `safe_eval_batch`, so process and interpreter startup
+    is paid once rather than per call, and each call gets fresh globals and its
+    own stderr and returncode. they share one interpreter, with the same caveat
+    as `safe_eval_batch`; use `safe_func_call` when that matters.
+    """
+    outputs: list[SafeEvalBytesResult] = _run_batch(
+        [_func_call_code(code, args, kwargs, func_name) for args, kwargs in calls],
+        timeout,
+        wasmtime_exec,
+        wasm_rustpython_path,
+    )
+    return [_parse_func_call(output) for output in outputs]
+
+
+def _func_call_code(code: str, args: list, kwargs: dict, func_name: str) -> str:
+    """`code`, followed by the wrapper and a call of `func_name`"""
+    # plain concatenation, so `code` is copied once and never scanned for `{}`.
+    # `repr` gives a valid Python literal for any JSON text, quotes and
+    # backslashes included, so the payload cannot break out of the string
+    return "".join(
+        (
+            FUNC_CALL_HEADER,
+            code,
+            FUNC_CALL_PRELUDE,
+            f"__wse_run({func_name}, {_json_dumps([args, kwargs])!r})\n",
+        )
+    )
+
+
+def _parse_func_call(output: SafeEvalBytesResult) -> FuncCallResult:
+    """extract the framed return value from the output of a wrapped call
+
+    only the framed tail of stdout is decoded and parsed, whatever (and however
+    much) the function printed before it is never decoded at all.
+    """
+    stdout, stderr_bytes, returncode = output
+    stderr: str = _decode_text(stderr_bytes)
+    result: Any = _NO_RESULT
+    marker_idx: int = stdout.rfind(_RESULT_MARKER_BYTES)
+    if returncode == 0 and marker_idx != -1:
+        payload, end, _ = stdout[marker_idx + len(_RESULT_MARKER_BYTES) :].partition(
+            _RESULT_END_BYTES
+        )
+        try:
+            if not end:
+                raise ValueError("result frame is not terminated")
+            result = _json_loads(payload)
+        except Exception as e:
+            result = _PARSE_ERROR
+            stderr += f"\nError parsing stdout: {e}"
 
     return FuncCallResult(
         result=result,